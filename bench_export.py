@@ -0,0 +1,240 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import tempfile
+import time
+import timeit
+from dotenv import load_dotenv
+from db_pool import close_pool, pooled_connection
+
+
+# Scaling benchmark for the catalog exporters in test.py.
+# Seeds a local Postgres (the database in the .env settings, one schema per
+# scale) with synthetic locations, positions and locations_positions, then runs
+# every exporter in its own process and records wall time, query count, peak RSS
+# and output bytes as JSON, so runs can be compared over time.
+#
+#   python bench_export.py --scales 100 1000 10000 100000
+
+load_dotenv(override=True)
+
+SCALES = [100, 1000, 10000, 100000]
+EXPORTERS = [
+    "export_knowledge_files",
+    "export_knowledge_files_streaming",
+    "get_all_locations",
+    "all_available_positions_details",
+    "generate_positions_available_for_locations",
+    "generate_grouped_available_locations_files",
+    "generate_compact_location_files",
+]
+RESULTS_DIR = "bench_results"
+EXPORTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+
+# Synthetic catalog: a few dozen position types, roughly 20 stores per city and
+# about a fifth of the positions open in each store, a few filled up or inactive.
+SEED_SQL = """
+DROP SCHEMA IF EXISTS {schema} CASCADE;
+CREATE SCHEMA {schema};
+SET LOCAL search_path TO {schema};
+
+CREATE TABLE positions (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    key_responsibilities TEXT[],
+    qualifications TEXT,
+    benefits TEXT[],
+    salary_range TEXT,
+    salary_currency TEXT,
+    salary_period TEXT,
+    job_type TEXT,
+    location_type TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE TABLE locations (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    address TEXT,
+    city TEXT,
+    state TEXT,
+    zip TEXT,
+    phone TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE TABLE locations_positions (
+    location_id INTEGER NOT NULL REFERENCES locations(id),
+    position_id INTEGER NOT NULL REFERENCES positions(id),
+    max_openings INTEGER NOT NULL,
+    filled_openings INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (location_id, position_id)
+);
+
+INSERT INTO positions (name, description, key_responsibilities, qualifications, benefits,
+                       salary_range, salary_currency, salary_period, job_type, location_type, is_active)
+SELECT 'Puesto ' || g,
+       'Perfil: Bachillerato concluido, experiencia en ventas y atención a clientes. Horario: Lunes a Viernes ' || g,
+       ARRAY['Atención a clientes', 'Manejo de caja', 'Control de inventario'],
+       'Bachillerato concluido',
+       ARRAY['Prestaciones de ley', 'Seguro de vida', 'Caja de ahorro'],
+       '$' || (8000 + g * 100),
+       'MXN',
+       'mes',
+       'Tiempo completo',
+       'Presencial',
+       g %% 10 <> 0
+FROM generate_series(1, %(positions)s) AS g;
+
+INSERT INTO locations (name, address, city, state, zip, phone, is_active)
+SELECT 'TIENDA ' || g,
+       'Av. Principal ' || g || ', Col. Centro',
+       'Ciudad ' || (g %% %(cities)s),
+       'Estado ' || (g %% 32),
+       lpad(((g * 37) %% 99999)::TEXT, 5, '0'),
+       '55' || lpad(g::TEXT, 8, '0'),
+       g %% 20 <> 0
+FROM generate_series(1, %(stores)s) AS g;
+
+INSERT INTO locations_positions (location_id, position_id, max_openings, filled_openings)
+SELECT l.id, p.id, 3, (l.id + p.id) %% 4
+FROM locations l
+JOIN positions p ON (l.id * 7 + p.id) %% 5 = 0;
+
+ANALYZE;
+"""
+
+
+def seed(scale):
+    schema = f"bench_{scale}"
+    start = timeit.default_timer()
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SEED_SQL.format(schema=schema),
+                {"stores": scale, "cities": max(5, scale // 20), "positions": 40},
+            )
+        connection.commit()
+    print(f"Seeded {schema} with {scale} stores in {timeit.default_timer() - start:.1f}s")
+    return schema
+
+
+def drop(schema):
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        connection.commit()
+
+
+# Runs in a child process so peak RSS belongs to this exporter alone
+def _run_exporter(name, schema, workdir, results):
+    # libpq reads PGOPTIONS, so every pooled connection uses the benchmark schema
+    os.environ["PGOPTIONS"] = f"-c search_path={schema}"
+    os.chdir(workdir)
+
+    spec = importlib.util.spec_from_file_location("exporter", EXPORTER_PATH)
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    from db_pool import pool_stats
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = timeit.default_timer()
+    getattr(exporter, name)()
+    wall_time = timeit.default_timer() - start
+
+    files = {
+        os.path.relpath(os.path.join(root, f), workdir): os.path.getsize(os.path.join(root, f))
+        for root, _, names in os.walk(workdir)
+        for f in names
+    }
+    results.put({
+        "wall_time": wall_time,
+        "queries": pool_stats()["queries"],
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "rss_before_kb": rss_before,
+        "output_bytes": sum(files.values()),
+        "files": files,
+    })
+
+
+def run_exporter(name, schema):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as workdir:
+        process = context.Process(target=_run_exporter, args=(name, schema, workdir, results))
+        process.start()
+        # Read the result before joining, a child does not exit until what it queued is read
+        result = None
+        while result is None:
+            alive = process.is_alive()
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                if not alive:
+                    break
+        process.join()
+        if result is None:
+            return {"error": f"exit code {process.exitcode}"}
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the catalog exporters against synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="number of stores")
+    parser.add_argument("--exporters", nargs="+", default=EXPORTERS, choices=EXPORTERS)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schemas")
+    parser.add_argument("--output", help="results file (default: bench_results/export_<timestamp>.json)")
+    args = parser.parse_args()
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "results": [],
+    }
+
+    for scale in args.scales:
+        schema = seed(scale)
+        try:
+            for name in args.exporters:
+                result = run_exporter(name, schema)
+                result.update({"scale": scale, "exporter": name})
+                report["results"].append(result)
+                if "error" in result:
+                    print(f"{scale:>7} stores  {name}: {result['error']}")
+                else:
+                    print(
+                        f"{scale:>7} stores  {name}: {result['wall_time']:.3f}s, "
+                        f"{result['queries']} queries, {result['peak_rss_kb'] / 1024:.1f} MB peak RSS, "
+                        f"{result['output_bytes']} bytes"
+                    )
+        finally:
+            if not args.keep:
+                drop(schema)
+    close_pool()
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"export_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import re
+from catalog import fold
+from place_index import PlaceIndex, place_key
+
+
+# Structured facts a candidate gives during the interview (name, age, email, city, state,
+# store and position), pulled from their own messages. In windowing mode the thread
+# only keeps the last turns, so the facts are sent with every run as a short summary
+# and the assistant does not ask for them again.
+
+FACTS = ("name", "age", "email", "city", "state", "location", "position")
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+AGE = re.compile(r"\b(\d{2})\s*años\b|\btengo\s+(\d{2})\b", re.IGNORECASE)
+# "me llamo Ana López", "mi nombre es ana lopez y tengo..."
+NAME = re.compile(
+    r"\b(?:me llamo|mi nombre es)\s+([^\W\d_]+(?:\s+(?!(?:y|e|tengo|soy|de|del|mi|con)\b)[^\W\d_]+){0,3})",
+    re.IGNORECASE,
+)
+
+_terms = {"snapshot_hash": None}
+
+
+# Store and position names of the catalog (folded, longest first) and its place index
+def _catalog_terms(catalog):
+    if _terms["snapshot_hash"] != catalog.snapshot_hash:
+        locations = {fold(location.name): location for location in catalog.locations.values()}
+        positions = {fold(position.name): position for position in catalog.positions.values()}
+        places = PlaceIndex.from_catalog(catalog)
+        _terms.update(
+            snapshot_hash=catalog.snapshot_hash,
+            location=sorted(locations.items(), key=lambda item: -len(item[0])),
+            position=sorted(positions.items(), key=lambda item: -len(item[0])),
+            places=places,
+            place_words=max((len(key.split()) for key in places.keys), default=0),
+        )
+    return _terms
+
+
+def _find(terms, text):
+    words = re.sub(r"[^\w]", " ", text).split()
+    padded = f" {' '.join(words)} "
+    for term, value in terms:
+        if f" {term} " in padded:
+            return value
+    return None
+
+
+# City and state named in the text, None for the ones not named. The longest place names
+# are taken first and the shorter ones inside them are not: "Nuevo León" is the state,
+# not the city León. Short aliases ("nl", "ver") are left out, they are common words.
+def _find_places(places, max_words, text):
+    words = place_key(text).split()
+    found = []
+    taken = set()
+    for size in range(min(max_words, len(words)), 0, -1):
+        for start in range(len(words) - size + 1):
+            span = range(start, start + size)
+            if taken.intersection(span):
+                continue
+            key = " ".join(words[start:start + size])
+            if len(key) < 4 and key not in places.keys:
+                continue
+            key = places.aliases.get(key, key)
+            if key in places.keys:
+                found.append((start, [places.places[index] for index in places.keys[key]]))
+                taken.update(span)
+
+    city = state = None
+    # In the order they were written, a later place replaces an earlier one
+    for _, matches in sorted(found, key=lambda item: item[0]):
+        states = [match[2] for match in matches if match[0] == "state"]
+        cities = [match for match in matches if match[0] == "city"]
+        if states:
+            state = states[0]
+        if cities:
+            # A city of the state named, when there are several with the name
+            in_state = [match for match in cities if match[2] == state]
+            city, state = (in_state or cities)[0][1:]
+    return city, state
+
+
+# Update facts (a dict) with what the candidate said in one message.
+# Later answers replace earlier ones. catalog may be None, then only the
+# name, age and email are looked for.
+def update_facts(facts, text, catalog=None):
+    email = EMAIL.search(text)
+    if email:
+        facts["email"] = email.group(0)
+
+    age = AGE.search(text)
+    if age:
+        value = int(age.group(1) or age.group(2))
+        if 15 <= value <= 80:
+            facts["age"] = value
+
+    name = NAME.search(text)
+    if name:
+        facts["name"] = name.group(1).title()
+
+    if catalog is not None:
+        terms = _catalog_terms(catalog)
+        folded = fold(text)
+        city, state = _find_places(terms["places"], terms["place_words"], text)
+        if city:
+            facts["city"] = city
+        if state:
+            facts["state"] = state
+        location = _find(terms["location"], folded)
+        if location:
+            facts["location"] = f"{location.name} (id {location.id})"
+            facts["city"] = location.city
+            facts["state"] = location.state
+        position = _find(terms["position"], folded)
+        if position:
+            facts["position"] = f"{position.name} (id {position.position_id})"
+    return facts
+
+
+# One line for the run's additional instructions, empty when nothing is known yet
+def facts_summary(facts):
+    known = [f"{fact}: {facts[fact]}" for fact in FACTS if facts.get(fact) is not None]
+    if not known:
+        return ""
+    return "Candidate facts collected so far (do not ask for them again): " + "; ".join(known) + "."
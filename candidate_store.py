@@ -0,0 +1,293 @@
+import argparse
+import atexit
+import csv
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from db_pool import pooled_connection
+from turn_metrics import count, span
+
+
+# Candidate data captured during the interview through the save_candidate function tool.
+# The arguments are checked against the tool's strict schema and the record is put on an
+# in-process write-behind queue; a background thread writes the queue to Postgres in
+# batches of CANDIDATE_BATCH_SIZE records, or every CANDIDATE_FLUSH_SECONDS when fewer
+# come in, with COPY (or a multi-row INSERT). The chat turn never waits on the database.
+#
+#   python candidate_store.py --create-table   # once per database
+
+load_dotenv(override=True)
+
+CANDIDATE_BATCH_SIZE = int(os.getenv("CANDIDATE_BATCH_SIZE", "500"))
+CANDIDATE_FLUSH_SECONDS = float(os.getenv("CANDIDATE_FLUSH_SECONDS", "2"))
+# Records waiting to be written, new ones are dropped (and counted) while the queue is full
+CANDIDATE_QUEUE_MAX = int(os.getenv("CANDIDATE_QUEUE_MAX", "100000"))
+# "copy" or "insert"
+CANDIDATE_WRITE_METHOD = os.getenv("CANDIDATE_WRITE_METHOD", "copy")
+# Seconds to wait before writing a batch again after a database error
+CANDIDATE_RETRY_SECONDS = float(os.getenv("CANDIDATE_RETRY_SECONDS", "5"))
+
+CANDIDATE_FIELDS = (
+    "name",
+    "email",
+    "phone",
+    "experience",
+    "education",
+    "referral_source",
+    "interview_slot",
+    "location_id",
+    "position_id",
+)
+
+# Strict mode makes the model fill in every field, the ones not known yet are null.
+# Strict schemas do not take maxLength or pattern, those are checked by validate_candidate.
+SAVE_CANDIDATE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "save_candidate",
+        "description": "Save the candidate's answers. Call it whenever the candidate gives or corrects "
+                       "one of them, with everything known so far and null for the rest.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "name": {"type": ["string", "null"], "description": "Full name"},
+                "email": {"type": ["string", "null"], "description": "Email address"},
+                "phone": {"type": ["string", "null"], "description": "Phone number"},
+                "experience": {"type": ["string", "null"], "description": "Work experience, in the candidate's words"},
+                "education": {"type": ["string", "null"], "description": "Highest level of education"},
+                "referral_source": {
+                    "type": ["string", "null"],
+                    "description": "How the candidate heard about the position",
+                },
+                "interview_slot": {
+                    "type": ["string", "null"],
+                    "description": "Preferred interview date and time, e.g. 2025-02-03 10:00",
+                },
+                "location_id": {"type": ["integer", "null"], "description": "Id of the location applied to"},
+                "position_id": {"type": ["integer", "null"], "description": "Id of the position applied to"},
+            },
+            "required": list(CANDIDATE_FIELDS),
+            "additionalProperties": False,
+        },
+    },
+}
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS candidates (
+    id BIGSERIAL PRIMARY KEY,
+    thread_id TEXT,
+    saved_at TIMESTAMPTZ NOT NULL,
+    name TEXT,
+    email TEXT,
+    phone TEXT,
+    experience TEXT,
+    education TEXT,
+    referral_source TEXT,
+    interview_slot TEXT,
+    location_id INTEGER,
+    position_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS candidates_thread_id ON candidates (thread_id, saved_at);
+"""
+
+_COLUMNS = ("thread_id", "saved_at") + CANDIDATE_FIELDS
+
+# Longest answer accepted for each text field
+MAX_LENGTHS = {
+    "name": 200,
+    "email": 254,
+    "phone": 40,
+    "experience": 2000,
+    "education": 500,
+    "referral_source": 200,
+    "interview_slot": 100,
+}
+PATTERNS = {"email": re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")}
+
+_TYPES = {
+    "string": lambda value: isinstance(value, str),
+    # bool is an int in Python, not in JSON
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+
+
+# The save_candidate arguments as a dict, ValueError when they do not match the schema
+def validate_candidate(arguments, schema=SAVE_CANDIDATE_TOOL["function"]["parameters"]):
+    if not isinstance(arguments, dict):
+        raise ValueError("expected an object")
+    properties = schema["properties"]
+    unknown = sorted(set(arguments) - set(properties))
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    missing = [field for field in schema["required"] if field not in arguments]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+
+    for field, rules in properties.items():
+        value = arguments[field]
+        if not any(_TYPES[kind](value) for kind in rules["type"]):
+            raise ValueError(f"{field} must be {' or '.join(rules['type'])}")
+        if isinstance(value, str):
+            if len(value) > MAX_LENGTHS.get(field, len(value)):
+                raise ValueError(f"{field} is longer than {MAX_LENGTHS[field]} characters")
+            if field in PATTERNS and value.strip() and not PATTERNS[field].search(value.strip()):
+                raise ValueError(f"{field} is not valid")
+    # Blank answers are not answers
+    return {
+        field: (value.strip() or None) if isinstance(value, str) else value
+        for field, value in arguments.items()
+    }
+
+
+# In-process write-behind queue of candidate records, written by a background thread
+class CandidateWriter:
+    def __init__(self, batch_size=CANDIDATE_BATCH_SIZE, flush_seconds=CANDIDATE_FLUSH_SECONDS,
+                 max_queued=CANDIDATE_QUEUE_MAX, method=CANDIDATE_WRITE_METHOD):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.method = method
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Queue a validated record, False when the queue is full
+    def submit(self, thread_id, candidate):
+        record = dict(candidate, thread_id=thread_id, saved_at=datetime.now(timezone.utc))
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            count("candidates_dropped")
+            return False
+        count("candidates_queued")
+        return True
+
+    # Up to batch_size records, waiting at most flush_seconds after the first one
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        flush_at = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            # Past the flush time or when stopping, only what is already queued
+            timeout = 0 if self._stop.is_set() else flush_at - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, connection, records):
+        rows = [tuple(record[column] for column in _COLUMNS) for record in records]
+        with connection.cursor() as cursor:
+            if self.method == "copy":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    # None goes as an empty unquoted field, NULL in COPY's csv format (no value is blank)
+                    writer.writerow(["" if value is None else value for value in row])
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY candidates ({', '.join(_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+                )
+            else:
+                execute_values(
+                    cursor,
+                    f"INSERT INTO candidates ({', '.join(_COLUMNS)}) VALUES %s",
+                    rows,
+                    page_size=len(rows),
+                )
+        connection.commit()
+
+    # Write a batch, retrying after database errors until it is written or the writer stops
+    def _flush(self, batch):
+        # Every save carries all the answers so far, only the last one of each thread is kept
+        latest = {}
+        for index, record in enumerate(batch):
+            latest[record["thread_id"] or index] = record
+        records = list(latest.values())
+
+        while True:
+            try:
+                with span("candidate_flush", records=len(records), queued=len(batch)):
+                    with pooled_connection() as connection:
+                        self._write(connection, records)
+                count("candidates_written", len(records))
+                return
+            except (psycopg2.Error, pool.PoolError) as error:
+                count("candidate_flush_failures")
+                print(f"Error writing {len(records)} candidates: {error}")
+                if self._stop.wait(CANDIDATE_RETRY_SECONDS):
+                    print(f"{len(records)} candidates not written")
+                    return
+
+    def run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    # Write what is queued and stop, waiting up to timeout seconds
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+_candidate_writer = None
+_candidate_writer_lock = threading.Lock()
+
+
+# The process's writer, started on first use and flushed at exit
+def get_candidate_writer():
+    global _candidate_writer
+    with _candidate_writer_lock:
+        if _candidate_writer is None:
+            _candidate_writer = CandidateWriter().start()
+            atexit.register(_candidate_writer.stop)
+        return _candidate_writer
+
+
+# Handle a save_candidate call, the output for the assistant
+def save_candidate(arguments, thread_id=None):
+    candidate = validate_candidate(arguments)
+    if not get_candidate_writer().submit(thread_id, candidate):
+        return {"error": "Candidate data could not be saved right now, continue the interview"}
+    return {"saved": True}
+
+
+def create_table():
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_TABLE_SQL)
+        connection.commit()
+    print("Table 'candidates' created")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Candidate data saved by the save_candidate tool.")
+    parser.add_argument("--create-table", action="store_true", help="create the candidates table")
+    args = parser.parse_args()
+    if args.create_table:
+        create_table()
+    else:
+        print(json.dumps(SAVE_CANDIDATE_TOOL, indent=4))
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import sys
+import timeit
+import unicodedata
+from psycopg2 import sql
+from db_pool import pooled_connection
+
+
+# In-memory index of the locations and positions with available openings.
+# It is built from the same Postgres tables the knowledge files in test.py are
+# exported from, so the assistant can look things up with function calls
+# instead of a file_search pass over the text files. The exporter builds the
+# same model from its snapshot and every knowledge file is written from it.
+
+
+# Key used to compare city and state names
+def normalize(text):
+    return " ".join(str(text).split()).casefold()
+
+
+# normalize() without accents, for matching free text: "León" -> "leon"
+def fold(text):
+    text = unicodedata.normalize("NFKD", normalize(text))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+# A store. The records are shared by the catalogs built from one another (see
+# Catalog.updated) and must not be changed once their catalog is built.
+class Location:
+    __slots__ = ("id", "name", "address", "city", "state", "zip", "phone", "position_ids", "openings")
+
+    def __init__(self, location_id, name, address, city, state, zip_code, phone=None):
+        self.id = location_id
+        self.name = name
+        self.address = address
+        # Thousands of stores share a few hundred city and state names
+        self.city = _intern(city)
+        self.state = _intern(state)
+        self.zip = zip_code
+        self.phone = phone
+        # Available positions, and their (max_openings, filled_openings) when they were read
+        self.position_ids = []
+        self.openings = []
+
+    # The fields the assistant's tools return
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "address": self.address,
+            "city": self.city,
+            "state": self.state,
+            "zip": self.zip,
+        }
+
+
+POSITION_FIELDS = (
+    "position_id",
+    "name",
+    "description",
+    "key_responsibilities",
+    "qualifications",
+    "benefits",
+    "salary_range",
+    "salary_currency",
+    "salary_period",
+    "job_type",
+    "location_type",
+)
+
+
+# A position with openings and its details, in the order of POSITION_FIELDS
+class Position:
+    __slots__ = POSITION_FIELDS
+
+    def __init__(self, position_id, name, description=None, key_responsibilities=None, qualifications=None,
+                 benefits=None, salary_range=None, salary_currency=None, salary_period=None, job_type=None,
+                 location_type=None):
+        self.position_id = position_id
+        self.name = name
+        self.description = description
+        self.key_responsibilities = key_responsibilities
+        self.qualifications = qualifications
+        self.benefits = benefits
+        self.salary_range = salary_range
+        self.salary_currency = salary_currency
+        self.salary_period = salary_period
+        self.job_type = job_type
+        self.location_type = location_type
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in POSITION_FIELDS}
+
+
+# Locations by id (in the order they were added), positions by id, and integer-id
+# indexes by city, by state and by location. Build it with add_position, add_location
+# and add_opening, in that order for each location, then only read from it.
+# Locations without available positions are kept (the exporter lists them) but
+# are left out of the indexes.
+class Catalog:
+    def __init__(self, positions=None):
+        self.locations = {}
+        self.positions = {} if positions is None else positions
+        self.positions_by_location = {}
+        self.locations_by_city = {}
+        self.locations_by_state = {}
+        self._snapshot_hash = None
+
+    def add_position(self, position_id, *details):
+        self.positions[position_id] = Position(position_id, *details)
+
+    # The location's record, created the first time it is added
+    def add_location(self, location_id, name, address, city, state, zip_code, phone=None):
+        location = self.locations.get(location_id)
+        if location is None:
+            location = self.locations[location_id] = Location(location_id, name, address, city, state, zip_code, phone)
+        return location
+
+    def add_opening(self, location_id, position_id, max_openings=None, filled_openings=None):
+        location = self.locations[location_id]
+        if not location.position_ids:
+            self._index(location)
+        location.position_ids.append(position_id)
+        if max_openings is not None:
+            location.openings.append((max_openings, filled_openings))
+
+    def _index(self, location):
+        self.positions_by_location[location.id] = location.position_ids
+        self.locations_by_city.setdefault(normalize(location.city), []).append(location.id)
+        self.locations_by_state.setdefault(normalize(location.state), []).append(location.id)
+
+    # Changes whenever the data does, used to invalidate anything derived from it
+    @property
+    def snapshot_hash(self):
+        if self._snapshot_hash is None:
+            digest = hashlib.sha256()
+            for location_id in sorted(self.locations):
+                location = self.locations[location_id]
+                digest.update(json.dumps([
+                    location.id, location.name, location.address, location.city, location.state,
+                    location.zip, location.phone, location.position_ids, location.openings,
+                ], default=str).encode() + b"\n")
+            for position_id in sorted(self.positions):
+                digest.update(json.dumps(self.positions[position_id].as_dict(), default=str).encode() + b"\n")
+            self._snapshot_hash = digest.hexdigest()
+        return self._snapshot_hash
+
+    # A new catalog with the locations in location_ids replaced by the ones in changes
+    # (a catalog read for those locations only) and the positions of changes. The other
+    # location records are shared. The result is the same as loading the whole catalog again.
+    def updated(self, location_ids, changes):
+        location_ids = set(location_ids)
+        catalog = Catalog(changes.positions)
+        kept = (location_id for location_id in self.locations if location_id not in location_ids)
+        for location_id in sorted(set(kept) | changes.locations.keys()):
+            location = changes.locations.get(location_id) or self.locations[location_id]
+            catalog.locations[location_id] = location
+            if location.position_ids:
+                catalog._index(location)
+        return catalog
+
+    # Locations in a city and/or state. Either one can be omitted.
+    def find_locations(self, city=None, state=None):
+        if city:
+            location_ids = self.locations_by_city.get(normalize(city), [])
+            if state:
+                state = normalize(state)
+                location_ids = [
+                    location_id for location_id in location_ids
+                    if normalize(self.locations[location_id].state) == state
+                ]
+        elif state:
+            location_ids = self.locations_by_state.get(normalize(state), [])
+        else:
+            location_ids = []
+        return [self.locations[location_id].as_dict() for location_id in location_ids]
+
+    # Positions available in a location
+    def positions_for_location(self, location_id):
+        return [
+            {"id": position_id, "name": self.positions[position_id].name}
+            for position_id in self.positions_by_location.get(location_id, [])
+            if position_id in self.positions
+        ]
+
+    # Full details of a position
+    def position_details(self, position_id):
+        position = self.positions.get(position_id)
+        return position.as_dict() if position else None
+
+
+def _read_catalog(connection, location_ids=None):
+    catalog = Catalog()
+    with connection.cursor() as cursor:
+        # Details of the positions with openings
+        cursor.execute(sql.SQL("""
+            SELECT DISTINCT
+                lp.position_id,
+                p.name,
+                p.description,
+                p.key_responsibilities,
+                p.qualifications,
+                p.benefits,
+                p.salary_range,
+                p.salary_currency,
+                p.salary_period,
+                p.job_type,
+                p.location_type
+            FROM positions p
+            JOIN locations_positions lp ON p.id = lp.position_id
+            WHERE p.is_active = TRUE
+              AND lp.filled_openings < lp.max_openings
+        """))
+        for row in cursor:
+            catalog.add_position(*row)
+
+        # Active locations with their available positions, all of them or only the given ones
+        cursor.execute(sql.SQL("""
+            SELECT l.id AS location_id, l.name AS location_name, l.address, l.city, l.state, l.zip,
+                   p.id AS position_id
+            FROM locations l
+            JOIN locations_positions lp ON l.id = lp.location_id
+            JOIN positions p ON lp.position_id = p.id
+            WHERE l.is_active = TRUE
+              AND p.is_active = TRUE
+              AND lp.filled_openings < lp.max_openings
+              {location_filter}
+            ORDER BY l.id, p.id
+        """).format(
+            location_filter=sql.SQL("AND l.id = ANY(%(location_ids)s)" if location_ids is not None else "")
+        ), {"location_ids": list(location_ids or [])})
+        for location_id, name, address, city, state, zip_code, position_id in cursor:
+            catalog.add_location(location_id, name, address, city, state, zip_code)
+            catalog.add_opening(location_id, position_id)
+    connection.commit()
+    return catalog
+
+
+# Query the database and build the catalog
+def load_catalog(connection=None):
+    start = timeit.default_timer()
+
+    if connection is None:
+        with pooled_connection() as connection:
+            catalog = _read_catalog(connection)
+    else:
+        catalog = _read_catalog(connection)
+
+    print(
+        f"Catalog loaded: {len(catalog.locations)} locations, {len(catalog.positions)} positions "
+        f"in {timeit.default_timer() - start:.3f}s"
+    )
+    return catalog
+
+
+# Apply changed locations and positions to a catalog, reading only the rows of the
+# locations affected: the changed ones and every one linked to a changed position.
+# read_catalog(connection, location_ids) reads them, as the full catalog was read (the
+# exporter passes its snapshot query, see test.update_export_snapshot).
+def load_catalog_changes(catalog, location_ids=(), position_ids=(), connection=None, read_catalog=_read_catalog):
+    start = timeit.default_timer()
+
+    def read(connection):
+        affected = set(location_ids)
+        if position_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT DISTINCT location_id FROM locations_positions WHERE position_id = ANY(%s)",
+                    (list(position_ids),),
+                )
+                affected.update(row[0] for row in cursor.fetchall())
+            # The reader may start its own transaction
+            connection.commit()
+        # Also the ones the catalog has for those positions, the links may be gone
+        for location_id, positions in catalog.positions_by_location.items():
+            if set(positions) & set(position_ids):
+                affected.add(location_id)
+        return affected, read_catalog(connection, affected)
+
+    if connection is None:
+        with pooled_connection() as connection:
+            affected, changes = read(connection)
+    else:
+        affected, changes = read(connection)
+
+    updated = catalog.updated(affected, changes)
+    print(
+        f"Catalog updated: {len(affected)} locations refreshed in {timeit.default_timer() - start:.3f}s"
+    )
+    return updated
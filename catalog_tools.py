@@ -0,0 +1,132 @@
+import json
+from candidate_store import SAVE_CANDIDATE_TOOL, save_candidate
+
+
+# Function tools the assistant can call to look up locations and positions.
+# They are answered in-process from the Catalog built in catalog.py and the place
+# index of place_index.py, except save_candidate, which queues the candidate's
+# answers (see candidate_store.py).
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "find_locations",
+            "description": "List the locations with available positions in a city and/or state. "
+                           "Use this instead of searching the locations files. Names written differently "
+                           "are resolved to the catalog's, the ones used are returned as resolved.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "city": {"type": "string", "description": "City name, e.g. Monterrey"},
+                    "state": {"type": "string", "description": "State name, e.g. Nuevo León"},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "resolve_place",
+            "description": "Match a city or state as the candidate wrote it (without accents, misspelled or "
+                           "abbreviated, e.g. cdmx, Edo Mex, NL, monterey) to the catalog's names, best match "
+                           "first. Use this instead of asking the candidate to write it again.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string", "description": "City or state as written, e.g. Nuevo Leon"},
+                },
+                "required": ["text"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "positions_for_location",
+            "description": "List the positions available in a location. "
+                           "Use this instead of searching positions_available_for_locations.txt.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "location_id": {"type": "integer", "description": "Location id"},
+                },
+                "required": ["location_id"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "nearest_locations",
+            "description": "List the locations nearest to a postal code, with the distance in km. "
+                           "Use this for candidates in Ciudad de México or Estado de México after asking for their zip code.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "zip_code": {"type": "string", "description": "5-digit postal code, e.g. 06600"},
+                },
+                "required": ["zip_code"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "position_details",
+            "description": "Get the full details of a position. "
+                           "Use this instead of searching all_available_positions_details.txt.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "position_id": {"type": "integer", "description": "Position id"},
+                },
+                "required": ["position_id"],
+            },
+        },
+    },
+    SAVE_CANDIDATE_TOOL,
+]
+
+TOOL_NAMES = [tool["function"]["name"] for tool in TOOLS]
+
+
+# Run a tool call and return its output as a JSON string.
+# thread_id is the interview's thread, the candidate records are keyed by it.
+def call_tool(catalog, name, arguments, zip_index=None, thread_id=None, place_index=None):
+    try:
+        arguments = json.loads(arguments or "{}")
+
+        if name == "find_locations":
+            city, state = arguments.get("city"), arguments.get("state")
+            result = {"locations": catalog.find_locations(city, state)}
+            if not result["locations"] and place_index is not None:
+                city, state = place_index.resolve_city_state(city, state)
+                result = {"locations": catalog.find_locations(city, state), "resolved": {"city": city, "state": state}}
+        elif name == "resolve_place":
+            if place_index is None:
+                result = {"error": "Place lookup is not available, use find_locations instead"}
+            else:
+                result = {"places": place_index.resolve(arguments["text"])}
+        elif name == "nearest_locations":
+            if zip_index is None:
+                result = {"error": "Zip code lookup is not available, use find_locations instead"}
+            else:
+                result = {"locations": [
+                    dict(catalog.locations[location_id].as_dict(), distance_km=distance)
+                    for location_id, distance in zip_index.nearest(arguments["zip_code"])
+                    if location_id in catalog.locations
+                ]}
+        elif name == "positions_for_location":
+            result = {"positions": catalog.positions_for_location(int(arguments["location_id"]))}
+        elif name == "position_details":
+            result = catalog.position_details(int(arguments["position_id"]))
+            if result is None:
+                result = {"error": "Position not found or without openings"}
+        elif name == "save_candidate":
+            result = save_candidate(arguments, thread_id)
+        else:
+            result = {"error": f"Unknown tool: {name}"}
+    except (ValueError, KeyError, TypeError) as error:
+        result = {"error": f"Invalid arguments: {error}"}
+
+    return json.dumps(result, ensure_ascii=False, default=str)
@@ -0,0 +1,280 @@
+import argparse
+import importlib.util
+import json
+import os
+import select
+import threading
+import time
+import timeit
+import psycopg2
+from dotenv import load_dotenv
+from db_pool import db_params, pooled_connection
+
+
+# Change-data capture for the catalog tables. Triggers on locations, positions and
+# locations_positions send a NOTIFY with the changed ids; ChangeWatcher LISTENs,
+# batches the notifications and hands them over once they stop coming for
+# CDC_DEBOUNCE_SECONDS (or CDC_MAX_DELAY_SECONDS after the first one).
+#
+# Run on its own, it keeps the knowledge files and the vector store current by
+# regenerating only the states touched by each batch:
+#
+#   python cdc_watcher.py --install-triggers   # once per database
+#   python cdc_watcher.py
+#
+# In the chat app (CDC_WATCH=true) it refreshes the in-memory catalog instead.
+
+load_dotenv(override=True)
+
+CHANNEL = "catalog_changes"
+CDC_DEBOUNCE_SECONDS = float(os.getenv("CDC_DEBOUNCE_SECONDS", "2"))
+CDC_MAX_DELAY_SECONDS = float(os.getenv("CDC_MAX_DELAY_SECONDS", "10"))
+# Seconds to wait before reconnecting after the listening connection is lost
+CDC_RECONNECT_SECONDS = float(os.getenv("CDC_RECONNECT_SECONDS", "5"))
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+    payload JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'locations' THEN
+        payload := json_build_object('location_id', changed.id);
+    ELSIF TG_TABLE_NAME = 'positions' THEN
+        payload := json_build_object('position_id', changed.id);
+    ELSE
+        payload := json_build_object('location_id', changed.location_id, 'position_id', changed.position_id);
+    END IF;
+    -- Identical notifications in one transaction are delivered once
+    PERFORM pg_notify('catalog_changes', payload::TEXT);
+
+    -- A row moved to another location or position changes the old one too
+    IF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'locations_positions'
+       AND (OLD.location_id <> NEW.location_id OR OLD.position_id <> NEW.position_id) THEN
+        PERFORM pg_notify('catalog_changes', json_build_object(
+            'location_id', OLD.location_id, 'position_id', OLD.position_id)::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS locations_notify ON locations;
+CREATE TRIGGER locations_notify AFTER INSERT OR UPDATE OR DELETE ON locations
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+
+DROP TRIGGER IF EXISTS positions_notify ON positions;
+CREATE TRIGGER positions_notify AFTER INSERT OR UPDATE OR DELETE ON positions
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+
+DROP TRIGGER IF EXISTS locations_positions_notify ON locations_positions;
+CREATE TRIGGER locations_positions_notify AFTER INSERT OR UPDATE OR DELETE ON locations_positions
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+"""
+
+
+def install_triggers():
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(TRIGGER_SQL)
+        connection.commit()
+    print(f"Triggers installed, changes are notified on channel '{CHANNEL}'")
+
+
+# Listens for catalog changes and calls on_batch(location_ids, position_ids, resync)
+# with the ids collected in each batch. resync is True on the first batch after
+# (re)connecting: notifications sent while nobody listened are lost, so the caller
+# should rebuild from scratch.
+class ChangeWatcher:
+    def __init__(self, on_batch, debounce=CDC_DEBOUNCE_SECONDS, max_delay=CDC_MAX_DELAY_SECONDS):
+        self.on_batch = on_batch
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        # LISTEN needs a connection of its own for as long as the watcher runs,
+        # so it does not hold one of the pool's connections
+        connection = psycopg2.connect(**db_params())
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return connection
+
+    def _listen(self, connection, resync):
+        location_ids = set()
+        position_ids = set()
+        first_at = last_at = None
+
+        while not self._stop.is_set():
+            # Wake up for the next notification, the end of the quiet period or the stop flag
+            timeout = 1.0
+            if first_at is not None:
+                now = time.monotonic()
+                timeout = max(0.0, min(last_at + self.debounce, first_at + self.max_delay) - now)
+
+            if select.select([connection], [], [], timeout) != ([], [], []):
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    if payload.get("location_id") is not None:
+                        location_ids.add(payload["location_id"])
+                    if payload.get("position_id") is not None:
+                        position_ids.add(payload["position_id"])
+                    last_at = time.monotonic()
+                    first_at = first_at or last_at
+
+            now = time.monotonic()
+            due = first_at is not None and (now - last_at >= self.debounce or now - first_at >= self.max_delay)
+            if due or resync:
+                self.on_batch(location_ids, position_ids, resync)
+                location_ids, position_ids = set(), set()
+                first_at = last_at = None
+                resync = False
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                connection = self._connect()
+            except psycopg2.OperationalError as error:
+                print(f"Change watcher could not connect: {error}")
+                self._stop.wait(CDC_RECONNECT_SECONDS)
+                continue
+            try:
+                self._listen(connection, resync=True)
+            except psycopg2.OperationalError as error:
+                print(f"Change watcher lost its connection: {error}")
+                self._stop.wait(CDC_RECONNECT_SECONDS)
+            finally:
+                connection.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def _load_exporter():
+    # test.py would clash with the standard library's test package on import
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py")
+    spec = importlib.util.spec_from_file_location("exporter", path)
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+# Keeps the knowledge files and the vector store current from the change batches.
+# The catalog of the last export is kept and patched with the rows of the affected
+# locations only (see update_export_snapshot in test.py); the files are written from it.
+class KnowledgeRefresher:
+    def __init__(self):
+        self.exporter = _load_exporter()
+        self.snapshot = None
+
+    def __call__(self, location_ids, position_ids, resync):
+        start = timeit.default_timer()
+        exporter = self.exporter
+        try:
+            if resync or self.snapshot is None:
+                snapshot = exporter.export_knowledge_files()
+                summary = "full export"
+            else:
+                previous = self.snapshot
+                snapshot = exporter.update_export_snapshot(previous, location_ids, position_ids)
+                exporter.all_available_positions_details(snapshot=snapshot)
+                if exporter.KNOWLEDGE_FORMAT == "compact":
+                    states = self._affected_states(previous, snapshot, location_ids, position_ids)
+                    written, deleted = exporter.write_compact_state_files(snapshot, states)
+                    summary = f"{len(states)} states, {len(written)} files written, {len(deleted)} deleted"
+                else:
+                    # The legacy files are not split by state, they are rewritten whole
+                    exporter.generate_positions_available_for_locations(snapshot=snapshot)
+                    exporter.generate_grouped_available_locations_files(snapshot=snapshot)
+                    summary = "legacy files rewritten"
+            self.snapshot = snapshot
+            exporter.generate_nearest_locations_by_zip(snapshot)
+            exporter.generate_place_index(snapshot)
+
+            # Only the files whose content changed are uploaded
+            exporter.sync_vector_store()
+            print(
+                f"Knowledge refreshed in {timeit.default_timer() - start:.1f}s ({summary}) for "
+                f"{len(location_ids)} locations and {len(position_ids)} positions changed"
+            )
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Error refreshing the knowledge files: {error}")
+            # The files may be half written, the next batch exports everything again
+            self.snapshot = None
+
+    # States of the changed locations and of the locations linked to changed positions,
+    # both where they were last exported and where they are now
+    @staticmethod
+    def _affected_states(previous, snapshot, location_ids, position_ids):
+        position_ids = set(position_ids)
+        states = set()
+        for catalog in (previous, snapshot):
+            for location in catalog.locations.values():
+                if location.id in location_ids or position_ids.intersection(location.position_ids):
+                    states.add(location.state)
+        states.discard(None)
+        return states
+
+
+_catalog_watcher = None
+_catalog_watcher_lock = threading.Lock()
+
+
+# Keep the chat app's cached catalog current, see resources.refresh_catalog.
+# Started once per process, later calls return the running watcher.
+def start_catalog_watcher():
+    global _catalog_watcher
+    from resources import invalidate, refresh_catalog
+
+    def on_batch(location_ids, position_ids, resync):
+        try:
+            if resync:
+                invalidate("catalog")
+            elif location_ids or position_ids:
+                refresh_catalog(location_ids, position_ids)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Error refreshing the catalog: {error}")
+            invalidate("catalog")
+
+    with _catalog_watcher_lock:
+        if _catalog_watcher is None:
+            _catalog_watcher = ChangeWatcher(on_batch).start()
+        return _catalog_watcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the knowledge files when the catalog tables change.")
+    parser.add_argument("--install-triggers", action="store_true", help="create the notification triggers and exit")
+    args = parser.parse_args()
+
+    if args.install_triggers:
+        install_triggers()
+        return
+
+    print(f"Listening on '{CHANNEL}' (debounce {CDC_DEBOUNCE_SECONDS}s, max delay {CDC_MAX_DELAY_SECONDS}s)")
+    watcher = ChangeWatcher(KnowledgeRefresher())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAIError
+from cdc_watcher import start_catalog_watcher
+from chat_turn import (
+    TURN_DEADLINE_SECONDS,
+    TURN_RETRIES,
+    client_method,
+    last_turns_truncation,
+    turn_flow,
+)
+from resources import call_catalog_tool, get_assistant, get_client, get_response_cache
+from turn_metrics import prometheus_text, span
+from warm_threads import get_warm_thread_pool
+
+
+# Headless asyncio chat backend. It runs the same turn flow as main_fs.py
+# (thread create, message create, run, fetch reply) on AsyncOpenAI, so one
+# process can hold many interviews in flight while their runs are queued or
+# in progress. main_fs.py becomes a client of it when CHAT_SERVICE_URL is set.
+#
+#   POST /turns    {"thread_id": null, "prompt": "...", "additional_instructions": "...", "pending_messages": []}
+#   GET  /ws       same messages as JSON frames; replies with thread, delta, done and error events
+#   GET  /metrics  per-stage latency summaries (Prometheus text)
+#   GET  /health
+#
+# Point OPENAI_BASE_URL at mock_assistants.py to run it without the OpenAI API.
+
+load_dotenv(override=True)
+
+CHAT_SERVICE_HOST = os.getenv("CHAT_SERVICE_HOST", "127.0.0.1")
+CHAT_SERVICE_PORT = int(os.getenv("CHAT_SERVICE_PORT", "8080"))
+# Turns allowed to be in flight at once, the rest wait for a slot
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", "500"))
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+# Answer repeated opening questions about the catalog from earlier responses
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
+# Apply catalog changes from the database as they happen (see cdc_watcher.py)
+CDC_WATCH = os.getenv("CDC_WATCH", "false").lower() in ("1", "true", "yes")
+# Attach the vector store and catalog tools to the assistant at startup (needs the real API)
+ASSISTANT_SYNC = os.getenv("ASSISTANT_SYNC", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_ADDITIONAL_INSTRUCTIONS = """. Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
+
+
+# Answer a function call from the in-memory catalog, off the event loop
+async def catalog_tool_handler(name, arguments, thread_id=None):
+    return await asyncio.to_thread(call_catalog_tool, name, arguments, thread_id)
+
+
+# Async version of chat_turn.run_tool_calls, the calls of a step run concurrently
+async def run_tool_calls_async(run, tool_handler):
+    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+
+    async def call(tool_call):
+        with span("tool_call", thread_id=run.thread_id, run_id=run.id, tool=tool_call.function.name):
+            output = await tool_handler(tool_call.function.name, tool_call.function.arguments, run.thread_id)
+        return {"tool_call_id": tool_call.id, "output": output}
+
+    with span("tool_step", thread_id=run.thread_id, run_id=run.id, tool_calls=len(tool_calls)):
+        return list(await asyncio.gather(*(call(tool_call) for tool_call in tool_calls)))
+
+
+# chat_turn.run_flow on AsyncOpenAI. tool_handler, on_text and on_thread_created are coroutine functions.
+async def run_flow_async(flow, client, tool_handler=None, on_text=None, on_thread_created=None):
+    result = error = None
+    while True:
+        try:
+            request = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result = error = None
+        kind = request[0]
+        try:
+            if kind == "api":
+                result = await client_method(client, request[1])(**request[2])
+            elif kind == "stream":
+                manager = client_method(client, request[1])(**request[2])
+                result = (manager, await manager.__aenter__())
+            elif kind == "next_event":
+                result = await anext(request[1][1], None)
+            elif kind == "close_stream":
+                await request[1][0].__aexit__(None, None, None)
+            elif kind == "tools":
+                result = await run_tool_calls_async(request[1], tool_handler)
+            elif kind == "blocking":
+                result = await asyncio.to_thread(request[1], *request[2])
+            elif kind == "sleep":
+                await asyncio.sleep(request[1])
+            elif kind == "thread_created" and on_thread_created:
+                await on_thread_created(request[1])
+            elif kind == "text" and on_text:
+                await on_text(request[1])
+        except Exception as exception:
+            error = exception
+
+
+# Async version of chat_turn.run_turn, the same flow on AsyncOpenAI. The result has no run
+# object, it is sent as JSON.
+async def run_turn_async(client, assistant_id, thread_id, prompt, additional_instructions, tool_handler=None,
+                         stream=True, on_text=None, on_thread_created=None, assistant_instructions=None,
+                         response_cache=None, pending_messages=None, truncation_strategy=None,
+                         deadline=TURN_DEADLINE_SECONDS, retries=TURN_RETRIES, thread_pool=None):
+    flow = turn_flow(
+        assistant_id,
+        thread_id,
+        prompt,
+        additional_instructions,
+        tools=tool_handler is not None,
+        stream=stream,
+        assistant_instructions=assistant_instructions,
+        response_cache=response_cache,
+        pending_messages=pending_messages,
+        truncation_strategy=truncation_strategy,
+        deadline=deadline,
+        retries=retries,
+        thread_pool=thread_pool,
+    )
+    result = await run_flow_async(flow, client, tool_handler, on_text, on_thread_created)
+    del result["run"]
+    return result
+
+
+class ChatService:
+    def __init__(self, client=None, assistant_id=None, tool_handler=catalog_tool_handler, stream=STREAM_RESPONSES,
+                 assistant_instructions=None, response_cache=None, thread_turns=0, thread_pool=None):
+        self.client = client or AsyncOpenAI()
+        self.assistant_id = assistant_id or os.getenv("ASST_ID")
+        # Needed to start a thread and its run in one request when there are additional instructions
+        self.assistant_instructions = assistant_instructions
+        self.response_cache = response_cache
+        # Empty threads for new interviews (see warm_threads.py)
+        self.thread_pool = thread_pool
+        # Thread turns each run reads when the turn does not say, 0 for the whole thread
+        self.thread_turns = thread_turns
+        self.tool_handler = tool_handler
+        self.stream = stream
+        self.slots = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+        # A thread accepts one run at a time, turns on the same thread wait for each other
+        self.thread_locks = {}
+        self.in_flight = 0
+
+    async def turn(self, thread_id, prompt, additional_instructions=None, on_text=None, on_thread_created=None,
+                   pending_messages=None, thread_turns=None):
+        if thread_turns is None:
+            thread_turns = self.thread_turns
+        turn_args = (prompt, additional_instructions, on_text, on_thread_created, pending_messages, thread_turns)
+        if not thread_id:
+            async with self.slots:
+                return await self._turn(None, *turn_args)
+
+        # [lock, number of turns using it], dropped when the last one is done
+        entry = self.thread_locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self.slots:
+                return await self._turn(thread_id, *turn_args)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.thread_locks.pop(thread_id, None)
+
+    async def _turn(self, thread_id, prompt, additional_instructions, on_text, on_thread_created, pending_messages,
+                    thread_turns):
+        self.in_flight += 1
+        try:
+            return await run_turn_async(
+                self.client,
+                self.assistant_id,
+                thread_id,
+                prompt,
+                additional_instructions if additional_instructions is not None else DEFAULT_ADDITIONAL_INSTRUCTIONS,
+                tool_handler=self.tool_handler,
+                stream=self.stream,
+                on_text=on_text,
+                on_thread_created=on_thread_created,
+                assistant_instructions=self.assistant_instructions,
+                response_cache=self.response_cache,
+                pending_messages=pending_messages,
+                truncation_strategy=last_turns_truncation(thread_turns),
+                thread_pool=self.thread_pool,
+            )
+        finally:
+            self.in_flight -= 1
+
+    # HTTP handlers
+
+    async def handle_turn(self, request):
+        try:
+            body = await request.json()
+            prompt = body["prompt"]
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({"error": "Expected a JSON body with a prompt"}, status=400)
+
+        try:
+            result = await self.turn(
+                body.get("thread_id"), prompt, body.get("additional_instructions"),
+                pending_messages=body.get("pending_messages"), thread_turns=body.get("thread_turns"),
+            )
+        except OpenAIError as error:
+            return web.json_response({"error": str(error)}, status=502)
+        except Exception as error:
+            print(f"Error in turn: {error!r}")
+            return web.json_response({"error": f"Internal error: {error}"}, status=500)
+        return web.json_response(result)
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        async for frame in ws:
+            if frame.type != WSMsgType.TEXT:
+                continue
+            try:
+                body = json.loads(frame.data)
+                prompt = body["prompt"]
+            except (ValueError, KeyError, TypeError):
+                await ws.send_json({"type": "error", "message": "Expected a JSON message with a prompt"})
+                continue
+
+            async def on_text(text):
+                await ws.send_json({"type": "delta", "text": text})
+
+            async def on_thread_created(thread_id):
+                await ws.send_json({"type": "thread", "thread_id": thread_id})
+
+            try:
+                result = await self.turn(
+                    body.get("thread_id"), prompt, body.get("additional_instructions"),
+                    on_text=on_text, on_thread_created=on_thread_created,
+                    pending_messages=body.get("pending_messages"), thread_turns=body.get("thread_turns"),
+                )
+                await ws.send_json(dict(result, type="done"))
+            except OpenAIError as error:
+                await ws.send_json({"type": "error", "message": str(error)})
+            except Exception as error:
+                print(f"Error in turn: {error!r}")
+                await ws.send_json({"type": "error", "message": f"Internal error: {error}"})
+
+        return ws
+
+    async def handle_metrics(self, request):
+        return web.Response(text=prometheus_text(), content_type="text/plain")
+
+    async def handle_health(self, request):
+        health = {"status": "ok", "in_flight": self.in_flight}
+        if self.thread_pool is not None:
+            health["warm_threads"] = self.thread_pool.stats()
+        return web.json_response(health)
+
+    def create_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.post("/turns", self.handle_turn),
+            web.get("/ws", self.handle_websocket),
+            web.get("/metrics", self.handle_metrics),
+            web.get("/health", self.handle_health),
+        ])
+        app.on_cleanup.append(self.close)
+        return app
+
+    async def close(self, app=None):
+        await self.client.close()
+
+
+def main():
+    assistant_id = os.getenv("ASST_ID")
+    assistant_instructions = None
+    if ASSISTANT_SYNC:
+        # Attach the vector store and the catalog tools once, before serving
+        assistant = get_assistant()
+        assistant_id = assistant.id
+        assistant_instructions = assistant.instructions
+    if CDC_WATCH:
+        start_catalog_watcher()
+
+    async def create_app():
+        return ChatService(
+            assistant_id=assistant_id,
+            assistant_instructions=assistant_instructions,
+            response_cache=get_response_cache() if RESPONSE_CACHE else None,
+            thread_pool=get_warm_thread_pool(get_client),
+        ).create_app()
+
+    web.run_app(create_app(), host=CHAT_SERVICE_HOST, port=CHAT_SERVICE_PORT)
+
+
+if __name__ == "__main__":
+    main()
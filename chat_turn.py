@@ -0,0 +1,631 @@
+import json
+import os
+import re  # Import regex for string cleaning
+import time
+import timeit
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from openai import AuthenticationError, NotFoundError, OpenAIError
+from turn_metrics import count, record_run_spans, record_span, span
+
+
+# Function calls of one run step answered at once, across all the turns of the process
+TOOL_CALL_WORKERS = int(os.getenv("TOOL_CALL_WORKERS", "8"))
+
+_tool_executor = None
+
+# Seconds a run may take (queued, in progress and answering function calls) before it is
+# cancelled, 0 for no limit. A turn makes at most 1 + TURN_RETRIES attempts and then
+# answers with TURN_FALLBACK_REPLY, so it never takes much longer than
+# (1 + TURN_RETRIES) * TURN_DEADLINE_SECONDS.
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "45"))
+TURN_RETRIES = int(os.getenv("TURN_RETRIES", "1"))
+TURN_FALLBACK_REPLY = os.getenv(
+    "TURN_FALLBACK_REPLY",
+    "Lo siento, tuve un problema para responderte. ¿Podrías repetir tu último mensaje?",
+)
+# Polling starts every POLL_INTERVAL_MIN_SECONDS and backs off to POLL_INTERVAL_MAX_SECONDS
+# while the run's status does not change
+POLL_INTERVAL_MIN_SECONDS = float(os.getenv("POLL_INTERVAL_MIN_SECONDS", "0.25"))
+POLL_INTERVAL_MAX_SECONDS = float(os.getenv("POLL_INTERVAL_MAX_SECONDS", "2"))
+POLL_BACKOFF = 1.5
+# Seconds to wait for a cancelled run to stop, the thread takes no new run until it does
+RUN_CANCEL_WAIT_SECONDS = float(os.getenv("RUN_CANCEL_WAIT_SECONDS", "5"))
+# Thread turns each run reads in the app's windowing mode (see last_turns_truncation)
+CHAT_THREAD_TURNS = int(os.getenv("CHAT_THREAD_TURNS", "10"))
+
+# Statuses of a run that has not finished yet
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action", "cancelling")
+
+
+# A run passed its deadline. thread_id is None if the thread was not created yet
+# (as far as this process knows), run_id if the run was not.
+class TurnDeadlineExceeded(Exception):
+    def __init__(self, thread_id, run_id):
+        super().__init__(f"Run {run_id} on thread {thread_id} passed its deadline")
+        self.thread_id = thread_id
+        self.run_id = run_id
+
+
+def _get_tool_executor():
+    global _tool_executor
+    if _tool_executor is None:
+        _tool_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS, thread_name_prefix="tool_call")
+    return _tool_executor
+
+
+# Citations added by file_search, e.g. 【4:0†source】
+CITATION_PATTERN = re.compile(r"【.*?】")
+
+
+# Remove citations from a complete assistant response
+def strip_citations(text):
+    return CITATION_PATTERN.sub("", text).strip()
+
+
+# Removes citations from text that arrives in pieces. A citation can be split
+# across several deltas, so anything after an opening 【 is held back until
+# the closing 】 arrives.
+class CitationFilter:
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, delta):
+        text = self.pending + delta
+        self.pending = ""
+        output = []
+        while text:
+            start = text.find("【")
+            if start == -1:
+                output.append(text)
+                break
+            output.append(text[:start])
+            end = text.find("】", start)
+            if end == -1:
+                # Wait for the rest of the citation
+                self.pending = text[start:]
+                break
+            text = text[end + 1:]
+        return "".join(output)
+
+    def flush(self):
+        # An opening bracket that never closed is not a citation, keep it
+        text = self.pending
+        self.pending = ""
+        return text
+
+
+# The text of the assistant's message in a page of a run's messages, citations stripped.
+# The page is the newest message created by the run (a single item), so the cost of
+# fetching it does not grow with the length of the thread.
+def _run_response(page):
+    for message in page.data:
+        if message.role != "assistant":
+            continue
+        for block in message.content:
+            if block.type == "text":
+                return strip_citations(block.text.value)
+    return None
+
+
+# Truncation strategy that keeps the last `turns` user and assistant turns of the thread
+# in the run's context. The assistant's instructions and the run's additional instructions
+# are not thread messages, so the interview script is never cut. None keeps the whole thread.
+def last_turns_truncation(turns):
+    if not turns:
+        return None
+    return {"type": "last_messages", "last_messages": 2 * turns}
+
+
+# Run every function call of a run that requires action.
+# tool_handler(name, arguments, thread_id) returns the output string for one call. The calls of
+# a step run concurrently, so the step takes as long as its slowest call, and the
+# outputs are returned in the order of the calls for a single submit_tool_outputs.
+def run_tool_calls(run, tool_handler):
+    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+
+    def call(tool_call):
+        with span("tool_call", thread_id=run.thread_id, run_id=run.id, tool=tool_call.function.name):
+            output = tool_handler(tool_call.function.name, tool_call.function.arguments, run.thread_id)
+        return {"tool_call_id": tool_call.id, "output": output}
+
+    with span("tool_step", thread_id=run.thread_id, run_id=run.id, tool_calls=len(tool_calls)):
+        if len(tool_calls) == 1:
+            return [call(tool_calls[0])]
+        return list(_get_tool_executor().map(call, tool_calls))
+
+
+# Seconds left until deadline_at (a timeit.default_timer() value), None without a deadline.
+# Raises TurnDeadlineExceeded when there are none left.
+def remaining_time(deadline_at, thread_id, run_id):
+    if deadline_at is None:
+        return None
+    remaining = deadline_at - timeit.default_timer()
+    if remaining <= 0:
+        raise TurnDeadlineExceeded(thread_id, run_id)
+    return remaining
+
+
+# The turn is written once, as generators that do no I/O themselves: they yield each
+# request they need and are sent its result. run_flow carries the requests out with
+# the blocking client and chat_service.run_flow_async with AsyncOpenAI, so both make
+# the same decisions. An error raised by a request is thrown into the generator at
+# the yield. The requests are
+#   ("api", method, kwargs)        client.beta.threads.<method>(**kwargs), e.g. "runs.retrieve"
+#   ("stream", method, kwargs)     open a run's event stream (a *_stream method)
+#   ("next_event", stream)         the stream's next event, None after the last one
+#   ("close_stream", stream)
+#   ("tools", run)                 outputs of the run's function calls, see run_tool_calls
+#   ("blocking", function, args)   function(*args), off the event loop in the service
+#   ("sleep", seconds)
+#   ("thread_created", thread_id)  and ("text", text), for the turn's callbacks
+
+
+def client_method(client, method):
+    target = client.beta.threads
+    for name in method.split("."):
+        target = getattr(target, name)
+    return target
+
+
+# Carry out a flow's requests with an OpenAI client and return the flow's result.
+# tool_handler, on_text and on_thread_created are the ones of run_turn.
+def run_flow(flow, client, tool_handler=None, on_text=None, on_thread_created=None):
+    result = error = None
+    while True:
+        try:
+            request = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result = error = None
+        kind = request[0]
+        try:
+            if kind == "api":
+                result = client_method(client, request[1])(**request[2])
+            elif kind == "stream":
+                manager = client_method(client, request[1])(**request[2])
+                result = (manager, manager.__enter__())
+            elif kind == "next_event":
+                result = next(request[1][1], None)
+            elif kind == "close_stream":
+                request[1][0].__exit__(None, None, None)
+            elif kind == "tools":
+                result = run_tool_calls(request[1], tool_handler)
+            elif kind == "blocking":
+                result = request[1](*request[2])
+            elif kind == "sleep":
+                time.sleep(request[1])
+            elif kind == "thread_created" and on_thread_created:
+                on_thread_created(request[1])
+            elif kind == "text" and on_text:
+                on_text(request[1])
+        except Exception as exception:
+            error = exception
+
+
+# Poll a run until it finishes, answering its function calls when there is a tool handler,
+# with a backoff that resets whenever the run's status changes
+def _poll_run(thread_id, run, tools=False, deadline_at=None):
+    interval = POLL_INTERVAL_MIN_SECONDS
+    while True:
+        if run.status == "requires_action" and tools:
+            tool_outputs = yield "tools", run
+            run = yield "api", "runs.submit_tool_outputs", {
+                "thread_id": thread_id,
+                "run_id": run.id,
+                "tool_outputs": tool_outputs,
+            }
+            interval = POLL_INTERVAL_MIN_SECONDS
+            continue
+        if run.status not in ACTIVE_RUN_STATUSES or run.status == "requires_action":
+            return run
+
+        remaining = remaining_time(deadline_at, thread_id, run.id)
+        yield "sleep", interval if remaining is None else min(interval, remaining)
+        status = run.status
+        run = yield "api", "runs.retrieve", {"run_id": run.id, "thread_id": thread_id}
+        interval = POLL_INTERVAL_MIN_SECONDS if run.status != status else min(interval * POLL_BACKOFF,
+                                                                               POLL_INTERVAL_MAX_SECONDS)
+
+
+# Request arguments of a new run. With thread_id None the thread, its messages and the
+# run are created in a single request (create_and_run), otherwise the messages are added
+# with the run.
+def _run_request(thread_id, assistant_id, additional_instructions, messages, instructions, truncation_strategy):
+    if thread_id is None:
+        return "create_and_run", {
+            "assistant_id": assistant_id,
+            "thread": {"messages": messages or []},
+            **({"instructions": instructions} if instructions else {}),
+            **({"truncation_strategy": truncation_strategy} if truncation_strategy else {}),
+        }
+    return "runs.create", {
+        "thread_id": thread_id,
+        "assistant_id": assistant_id,
+        "additional_instructions": additional_instructions,
+        **({"additional_messages": messages} if messages else {}),
+        **({"truncation_strategy": truncation_strategy} if truncation_strategy else {}),
+    }
+
+
+# Streaming version of each _run_request method
+_STREAM_METHODS = {"create_and_run": "create_and_run_stream", "runs.create": "runs.stream"}
+
+
+# Create and poll a run, answering its function calls until it stops requiring action.
+# Raises TurnDeadlineExceeded if the run is still going at deadline_at.
+# The thread and run ids are put in `ids` as soon as they are known.
+def _create_and_poll_run(thread_id, assistant_id, additional_instructions, tools=False, messages=None,
+                         instructions=None, truncation_strategy=None, deadline_at=None, ids=None):
+    method, arguments = _run_request(
+        thread_id, assistant_id, additional_instructions, messages, instructions, truncation_strategy
+    )
+    run = yield "api", method, arguments
+    if ids is not None:
+        ids.update(thread_id=run.thread_id, run_id=run.id)
+    if thread_id is None:
+        thread_id = run.thread_id
+        yield "thread_created", thread_id
+    return (yield from _poll_run(thread_id, run, tools, deadline_at))
+
+
+# Cancel a run and wait a moment for it to stop. Returns the last known run, None if
+# it could not be retrieved. The run may have finished in the meantime.
+# Without run_id, the thread's run that has not finished yet is cancelled, if there is one:
+# the run may have been created without its id reaching us.
+def _cancel_run(thread_id, run_id):
+    if thread_id is None:
+        return None
+    if run_id is None:
+        try:
+            page = yield "api", "runs.list", {"thread_id": thread_id, "order": "desc", "limit": 1}
+        except OpenAIError as error:
+            print(f"Could not look for an active run on thread {thread_id}: {error}")
+            return None
+        if not page.data or page.data[0].status not in ACTIVE_RUN_STATUSES:
+            return None
+        run_id = page.data[0].id
+    with span("run_cancel", thread_id=thread_id, run_id=run_id) as labels:
+        try:
+            run = yield "api", "runs.cancel", {"run_id": run_id, "thread_id": thread_id}
+        except OpenAIError:
+            # Already finished, the run says how
+            run = None
+        try:
+            wait_until = timeit.default_timer() + RUN_CANCEL_WAIT_SECONDS
+            while run is None or run.status in ACTIVE_RUN_STATUSES:
+                if run is not None:
+                    if timeit.default_timer() >= wait_until:
+                        break
+                    yield "sleep", POLL_INTERVAL_MIN_SECONDS
+                run = yield "api", "runs.retrieve", {"run_id": run_id, "thread_id": thread_id}
+        except OpenAIError as error:
+            print(f"Could not confirm the cancellation of run {run_id}: {error}")
+        labels["status"] = run.status if run else None
+    return run
+
+
+# Stream a run, handing the cleaned text to the turn's on_text as it arrives.
+# Function calls are answered and the run keeps streaming.
+# Returns the thread id, the final run, the cleaned response and the time to the
+# first token, measured from `start`. `ids` works as in _create_and_poll_run.
+def _stream_run(thread_id, assistant_id, additional_instructions, start=None, tools=False, messages=None,
+                instructions=None, truncation_strategy=None, deadline_at=None, ids=None):
+    if start is None:
+        start = timeit.default_timer()
+    # Bounds the wait for each event, the deadline is checked between them
+    timeout = remaining_time(deadline_at, thread_id, None)
+
+    citation_filter = CitationFilter()
+    response = ""
+    time_to_first_token = None
+    run = None
+
+    method, arguments = _run_request(
+        thread_id, assistant_id, additional_instructions, messages, instructions, truncation_strategy
+    )
+    request = ("stream", _STREAM_METHODS[method], dict(arguments, **({"timeout": timeout} if timeout else {})))
+    while request is not None:
+        stream = None
+        try:
+            stream = yield request
+            while True:
+                event = yield "next_event", stream
+                if event is None:
+                    break
+                if event.event == "thread.message.delta":
+                    for block in event.data.delta.content or []:
+                        if block.type != "text" or not block.text.value:
+                            continue
+                        text = citation_filter.feed(block.text.value)
+                        if not text:
+                            continue
+                        if time_to_first_token is None:
+                            time_to_first_token = timeit.default_timer() - start
+                        response += text
+                        yield "text", response.lstrip()
+                elif event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                    run = event.data
+                    if ids is not None:
+                        ids.update(thread_id=run.thread_id, run_id=run.id)
+                    if thread_id is None:
+                        thread_id = run.thread_id
+                        yield "thread_created", thread_id
+                if run is None or run.status in ACTIVE_RUN_STATUSES:
+                    remaining_time(deadline_at, thread_id, run.id if run else None)
+        except TurnDeadlineExceeded:
+            raise
+        except GeneratorExit:
+            # Nobody is carrying out the requests any more
+            stream = None
+            raise
+        except Exception as error:
+            # Waiting for the next event timed out (the error type depends on the HTTP client)
+            if deadline_at is not None and timeit.default_timer() >= deadline_at:
+                raise TurnDeadlineExceeded(thread_id, run.id if run else None) from error
+            raise
+        finally:
+            if stream is not None:
+                yield "close_stream", stream
+
+        request = None
+        if run is not None and run.status == "requires_action" and tools:
+            # Submit the tool outputs and keep streaming the same run
+            tool_outputs = yield "tools", run
+            timeout = remaining_time(deadline_at, thread_id, run.id)
+            request = ("stream", "runs.submit_tool_outputs_stream", {
+                "thread_id": thread_id,
+                "run_id": run.id,
+                "tool_outputs": tool_outputs,
+                **({"timeout": timeout} if timeout else {}),
+            })
+
+    return {
+        "thread_id": thread_id,
+        "run": run,
+        "response": strip_citations(response + citation_filter.flush()),
+        "time_to_first_token": time_to_first_token,
+    }
+
+
+# One chat turn as a flow, see run_turn (tools tells whether there is a tool handler)
+def turn_flow(assistant_id, thread_id, prompt, additional_instructions, tools=False, stream=True, start=None,
+              assistant_instructions=None, response_cache=None, pending_messages=None, truncation_strategy=None,
+              deadline=TURN_DEADLINE_SECONDS, retries=TURN_RETRIES, thread_pool=None):
+    if start is None:
+        start = timeit.default_timer()
+
+    cache_key = None
+    if response_cache is not None and thread_id is None and not pending_messages:
+        with span("response_cache") as labels:
+            # Building the key may load the catalog from the database
+            cache_key = yield "blocking", response_cache.key, (prompt,)
+            cached_response = response_cache.get(cache_key) if cache_key else None
+            labels["hit"] = cached_response is not None
+        if cached_response is not None:
+            count("turn_setup_round_trips_saved", 3)
+            result = cached_turn(prompt, cached_response, start)
+            record_span("turn", result["total_time"])
+            return result
+
+    # Separate thread, message and run requests this turn would have needed
+    round_trips_before = 3 if thread_id is None else 2
+    round_trips = 1
+    messages = list(pending_messages or []) + [{"role": "user", "content": prompt}]
+    instructions = None
+    warm_thread = False
+    if thread_id is None and thread_pool is not None:
+        thread_id = thread_pool.take()
+        warm_thread = thread_id is not None
+        if warm_thread:
+            yield "thread_created", thread_id
+    if thread_id is None and additional_instructions:
+        if assistant_instructions is not None:
+            instructions = f"{assistant_instructions} {additional_instructions}"
+        else:
+            with span("thread_create") as labels:
+                thread = yield "api", "create", {"messages": messages}
+                thread_id = labels["thread_id"] = thread.id
+            round_trips += 1
+            messages = None
+            yield "thread_created", thread_id
+    round_trips_saved = round_trips_before - round_trips
+
+    time_to_first_token = None
+    response = None
+    run = None
+    run_created = False
+    fallback = False
+    with span("run", thread_id=thread_id, round_trips_saved=round_trips_saved, warm_thread=warm_thread) as labels:
+        for attempt in range(1 + retries):
+            if attempt:
+                count("turn_retries")
+                if thread_id is not None and run_created:
+                    # The message is in the thread already, run it again
+                    messages = None
+                    instructions = None
+            deadline_at = timeit.default_timer() + deadline if deadline else None
+            ids = {"thread_id": thread_id, "run_id": None}
+            try:
+                if stream:
+                    result = yield from _stream_run(
+                        thread_id,
+                        assistant_id,
+                        additional_instructions,
+                        start=start,
+                        tools=tools,
+                        messages=messages,
+                        instructions=instructions,
+                        truncation_strategy=truncation_strategy,
+                        deadline_at=deadline_at,
+                        ids=ids,
+                    )
+                    run = result["run"]
+                    thread_id = result["thread_id"]
+                    response = result["response"]
+                    time_to_first_token = result["time_to_first_token"]
+                else:
+                    run = yield from _create_and_poll_run(
+                        thread_id,
+                        assistant_id,
+                        additional_instructions,
+                        tools=tools,
+                        messages=messages,
+                        instructions=instructions,
+                        truncation_strategy=truncation_strategy,
+                        deadline_at=deadline_at,
+                        ids=ids,
+                    )
+                    thread_id = run.thread_id
+            except TurnDeadlineExceeded as error:
+                count("turn_deadlines")
+                labels["deadline_fired"] = True
+                thread_id = error.thread_id or thread_id
+                ids["run_id"] = error.run_id or ids["run_id"]
+                run = yield from _cancel_run(thread_id, ids["run_id"])
+            except (AuthenticationError, NotFoundError):
+                # Retrying does not help, the caller fetches its client or assistant again
+                yield from _cancel_run(ids["thread_id"], ids["run_id"])
+                raise
+            except Exception as error:
+                # A tool handler or a request failed mid-run. Cancel the run, otherwise it is
+                # left waiting and the thread takes no new run until it expires.
+                print(f"Run attempt failed: {error!r}")
+                count("turn_errors")
+                labels["error"] = type(error).__name__
+                thread_id = ids["thread_id"] or thread_id
+                run = yield from _cancel_run(thread_id, ids["run_id"])
+            # Only a run this attempt created took its messages. A run _cancel_run found
+            # on the thread by itself is an older one, left active by an interrupted turn.
+            run_created = ids["run_id"] is not None
+
+            if run is not None and run.status == "completed":
+                break
+            if run is not None and run.status in ACTIVE_RUN_STATUSES:
+                # A run waiting for function calls nobody answers
+                run = (yield from _cancel_run(thread_id, run.id)) or run
+        else:
+            count("turn_fallbacks")
+            fallback = True
+            response = TURN_FALLBACK_REPLY
+            time_to_first_token = None
+
+        labels["thread_id"] = thread_id
+        labels["run_id"] = run.id if run else None
+        labels["attempts"] = attempt + 1
+        labels["fallback"] = fallback
+
+    if stream:
+        if time_to_first_token is not None:
+            record_span("first_token", time_to_first_token, thread_id, labels["run_id"])
+    elif not fallback:
+        # Retrieve the assistant's response for this run only
+        with span("message_retrieval", thread_id=thread_id, run_id=run.id):
+            page = yield "api", "messages.list", {"thread_id": thread_id, "run_id": run.id, "order": "desc", "limit": 1}
+        response = _run_response(page)
+
+    record_run_spans(run, thread_id)
+    count("turn_setup_round_trips", round_trips)
+    count("turn_setup_round_trips_saved", round_trips_saved)
+    total_time = timeit.default_timer() - start
+    record_span("turn", total_time, thread_id, labels["run_id"])
+
+    if cache_key is not None and not fallback and response:
+        response_cache.put(cache_key, response)
+
+    return {
+        "thread_id": thread_id,
+        "run": run,
+        "run_id": run.id if run else None,
+        "status": run.status if run else None,
+        "response": response,
+        "cached": False,
+        "fallback": fallback,
+        "pending_messages": [],
+        "round_trips_saved": round_trips_saved,
+        "time_to_first_token": time_to_first_token,
+        "total_time": total_time,
+    }
+
+
+# Run one chat turn: create the thread if needed, add the user's message and run the assistant.
+# The message always goes with the run request (and the new thread with it on the first
+# turn), so a turn takes one round-trip before the run starts instead of two or three.
+# create_and_run has no additional_instructions, so on the first turn they are appended to
+# assistant_instructions. Without those the new thread is created (with the message) first.
+# Each stage is recorded as a span with the thread and run ids, the whole turn as "turn".
+# on_thread_created(thread_id) is called as soon as a new thread exists.
+# truncation_strategy limits the thread messages the run reads, see last_turns_truncation.
+# A new interview takes a thread from thread_pool (see warm_threads.py) when one is ready.
+# An opening question found in response_cache is answered without any request; the
+# exchange is returned as pending_messages, to be passed to the next turn and added
+# to the thread with its run.
+# A run still going after `deadline` seconds is cancelled, and so is one whose function
+# calls or requests raise an error; a run that is cancelled or fails is retried up to
+# `retries` times on the same thread. AuthenticationError and NotFoundError are raised.
+# If none completes, the turn answers with TURN_FALLBACK_REPLY and "fallback" is True.
+# Returns the thread id, the final run and the response without citations.
+def run_turn(client, assistant_id, thread_id, prompt, additional_instructions,
+             tool_handler=None, stream=True, on_text=None, on_thread_created=None, start=None,
+             assistant_instructions=None, response_cache=None, pending_messages=None, truncation_strategy=None,
+             deadline=TURN_DEADLINE_SECONDS, retries=TURN_RETRIES, thread_pool=None):
+    flow = turn_flow(
+        assistant_id,
+        thread_id,
+        prompt,
+        additional_instructions,
+        tools=tool_handler is not None,
+        stream=stream,
+        start=start,
+        assistant_instructions=assistant_instructions,
+        response_cache=response_cache,
+        pending_messages=pending_messages,
+        truncation_strategy=truncation_strategy,
+        deadline=deadline,
+        retries=retries,
+        thread_pool=thread_pool,
+    )
+    return run_flow(flow, client, tool_handler, on_text, on_thread_created)
+
+
+# Result of a turn answered from the response cache, shaped like the one of run_turn
+def cached_turn(prompt, response, start):
+    elapsed = timeit.default_timer() - start
+    return {
+        "thread_id": None,
+        "run": None,
+        "run_id": None,
+        "status": "completed",
+        "response": response,
+        "cached": True,
+        "fallback": False,
+        "pending_messages": [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": response},
+        ],
+        "round_trips_saved": 3,
+        "time_to_first_token": elapsed,
+        "total_time": elapsed,
+    }
+
+
+# Run one chat turn on the chat service (chat_service.py) instead of calling OpenAI directly.
+# thread_turns is the window the run reads, 0 for the whole thread and None for the
+# service's default. Returns the same keys as run_turn, except the run object itself.
+def request_turn(service_url, thread_id, prompt, additional_instructions, pending_messages=None, thread_turns=None,
+                 timeout=120):
+    request = urllib.request.Request(
+        service_url.rstrip("/") + "/turns",
+        data=json.dumps({
+            "thread_id": thread_id,
+            "prompt": prompt,
+            "additional_instructions": additional_instructions,
+            "pending_messages": pending_messages or [],
+            "thread_turns": thread_turns,
+        }).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        result = json.loads(response.read())
+    result["run"] = None
+    return result
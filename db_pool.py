@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+
+
+# Shared, bounded pool of Postgres connections for the exporter and the chat app.
+# Use pooled_connection() instead of calling psycopg2.connect directly.
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "5"))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Connections idle for longer than this many seconds are checked before being handed out
+DB_HEALTH_CHECK_AFTER = float(os.getenv("DB_HEALTH_CHECK_AFTER", "30"))
+
+
+# Database connection parameters
+def db_params():
+    return {
+        "dbname": os.getenv("dbname"),
+        "user": os.getenv("user"),
+        "password": os.getenv("password"),
+        "host": os.getenv("host"),
+        "port": os.getenv("pg_port"),
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool fails right away when it is exhausted, the semaphore makes callers wait instead
+_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "queries": 0,
+    "timeouts": 0,
+    "health_check_failures": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+    "held_time": 0.0,
+    "max_held_time": 0.0,
+}
+
+
+# Cursor that counts the statements sent to the database
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with _stats_lock:
+            _stats["queries"] += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with _stats_lock:
+            _stats["queries"] += 1
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with _stats_lock:
+            _stats["queries"] += 1
+        return super().copy_expert(sql, file, size)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(
+                DB_POOL_MIN, DB_POOL_MAX, cursor_factory=CountingCursor, **db_params()
+            )
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+
+def _is_healthy(connection):
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# Get a connection from the pool, replacing it if it went stale while idle
+def _checkout():
+    connection_pool = get_pool()
+    connection = connection_pool.getconn()
+
+    last_used = _last_used.get(id(connection))
+    if connection.closed or (last_used is not None and time.monotonic() - last_used > DB_HEALTH_CHECK_AFTER):
+        if not _is_healthy(connection):
+            with _stats_lock:
+                _stats["health_check_failures"] += 1
+            _last_used.pop(id(connection), None)
+            connection_pool.putconn(connection, close=True)
+            connection = connection_pool.getconn()
+    return connection
+
+
+def _checkin(connection, broken=False):
+    connection_pool = get_pool()
+    if broken or connection.closed:
+        _last_used.pop(id(connection), None)
+        connection_pool.putconn(connection, close=True)
+    else:
+        # putconn rolls back any transaction left open
+        _last_used[id(connection)] = time.monotonic()
+        connection_pool.putconn(connection)
+
+
+# Borrow a connection from the pool for the duration of a with block
+@contextmanager
+def pooled_connection():
+    wait_start = timeit.default_timer()
+    if not _slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _stats_lock:
+            _stats["timeouts"] += 1
+        raise pool.PoolError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+
+    try:
+        connection = _checkout()
+        wait_time = timeit.default_timer() - wait_start
+        held_start = timeit.default_timer()
+        broken = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            held_time = timeit.default_timer() - held_start
+            _checkin(connection, broken)
+            with _stats_lock:
+                _stats["checkouts"] += 1
+                _stats["wait_time"] += wait_time
+                _stats["max_wait_time"] = max(_stats["max_wait_time"], wait_time)
+                _stats["held_time"] += held_time
+                _stats["max_held_time"] = max(_stats["max_held_time"], held_time)
+    finally:
+        _slots.release()
+
+
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    checkouts = stats["checkouts"] or 1
+    stats["avg_wait_time"] = stats["wait_time"] / checkouts
+    stats["avg_held_time"] = stats["held_time"] / checkouts
+    return stats
+
+
+def print_pool_stats():
+    stats = pool_stats()
+    print(
+        f"DB pool: {stats['checkouts']} checkouts, {stats['queries']} queries, "
+        f"wait avg {stats['avg_wait_time'] * 1000:.1f}ms max {stats['max_wait_time'] * 1000:.1f}ms, "
+        f"held avg {stats['avg_held_time'] * 1000:.1f}ms max {stats['max_held_time'] * 1000:.1f}ms, "
+        f"{stats['timeouts']} timeouts, {stats['health_check_failures']} failed health checks"
+    )
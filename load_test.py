@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from openai import OpenAI
+from bench_export import RESULTS_DIR, git_revision
+from chat_turn import TURN_DEADLINE_SECONDS, run_turn
+from mock_assistants import MockConfig, start_mock_server
+from turn_metrics import METRICS_FILE, QUANTILES, counters, flush_metrics
+
+
+# Load test of the chat turn flow of main_fs.py. N simulated candidates go through a
+# scripted interview (age check, city and state, store, position, personal data), each
+# turn through chat_turn.run_turn as in the app, against mock_assistants.py, so the
+# API latency and failures are configurable and no tokens are spent. The function
+# calls are answered by a stub that waits --tool-latency seconds instead of the catalog.
+#
+# The report has the throughput, the outcome of the turns and the p50/p95/p99 of the
+# turns (overall and per script step) and of the stages recorded by turn_metrics.
+#
+#   python load_test.py --candidates 200 --ramp-up 30 --run-latency 2 --failure-rate 0.02
+#
+# The mock runs in this process by default and shares its GIL with the candidates;
+# for large runs start mock_assistants.py on its own and pass --base-url.
+
+load_dotenv(override=True)
+
+ASSISTANT_ID = "asst_load_test"
+ADDITIONAL_INSTRUCTIONS = """and phone number. Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
+
+CITIES = [
+    ("Ciudad de México", "Ciudad de México"),
+    ("Guadalajara", "Jalisco"),
+    ("Monterrey", "Nuevo León"),
+    ("Puebla", "Puebla"),
+    ("Querétaro", "Querétaro"),
+    ("León", "Guanajuato"),
+    ("Mérida", "Yucatán"),
+    ("Tijuana", "Baja California"),
+]
+NAMES = ["Ana", "Luis", "María", "José", "Fernanda", "Carlos", "Daniela", "Jorge"]
+SURNAMES = ["López", "García", "Hernández", "Martínez", "Rodríguez", "Pérez", "Sánchez", "Ramírez"]
+
+# Step of the interview, the candidate's message and the function calls the mock asks for
+SCRIPT_STEPS = ("age", "city_state", "store", "position", "personal_data")
+
+
+# The interview of one candidate, as [(step, prompt, tool_calls), ...]
+def interview_script(number, rng):
+    city, state = rng.choice(CITIES)
+    location_id = rng.randint(1, 500)
+    position_id = rng.randint(1, 20)
+    name = f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}"
+    email = f"candidato{number}@example.com"
+    phone = f"55{rng.randint(10000000, 99999999)}"
+    candidate = {
+        "name": name, "email": email, "phone": phone, "experience": "Dos años en atención a clientes",
+        "education": "Preparatoria", "referral_source": "Facebook", "interview_slot": "Lunes 10:00",
+        "location_id": location_id, "position_id": position_id,
+    }
+    return [
+        ("age", f"Hola, tengo {rng.randint(18, 45)} años", []),
+        ("city_state", f"Vivo en {city}, {state}", [("find_locations", {"city": city, "state": state})]),
+        ("store", f"Me interesa la tienda {location_id}", [("positions_for_location", {"location_id": location_id})]),
+        ("position", f"Quiero el puesto {position_id} en la tienda {location_id}",
+         [("position_details", {"position_id": position_id})]),
+        ("personal_data", f"Me llamo {name}, mi correo es {email} y mi teléfono {phone}. "
+                          f"Tengo dos años de experiencia, terminé la preparatoria y los vi en Facebook. "
+                          f"Puedo el lunes a las 10:00",
+         [("save_candidate", candidate)]),
+    ]
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean": sum(values) / len(values)}
+    for q in QUANTILES:
+        summary[f"p{int(q * 100)}"] = values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return summary
+
+
+# Durations of the turn_metrics spans recorded since started_at, by stage
+def _span_durations(started_at):
+    flush_metrics()
+    durations = {}
+    for path in (METRICS_FILE + ".1", METRICS_FILE):
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["time"] >= started_at:
+                    durations.setdefault(record["stage"], []).append(record["duration"])
+    return durations
+
+
+class LoadTest:
+    def __init__(self, client, stream=True, think_time=0.0, tool_latency=0.0, deadline=TURN_DEADLINE_SECONDS,
+                 seed=None):
+        self.client = client
+        self.stream = stream
+        self.think_time = think_time
+        self.tool_latency = tool_latency
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.scripts = {}
+        # Function calls of each prompt, for the mock
+        self.tool_calls = {}
+        self.turns = []
+        self._lock = threading.Lock()
+
+    def add_candidates(self, n):
+        for number in range(n):
+            script = interview_script(number, self.rng)
+            self.scripts[number] = script
+            for _, prompt, calls in script:
+                self.tool_calls[prompt] = calls
+
+    def mock_tool_calls(self, prompt):
+        return self.tool_calls.get(prompt, [])
+
+    def tool_handler(self, name, arguments, thread_id=None):
+        if self.tool_latency:
+            time.sleep(self.tool_latency)
+        return json.dumps({"ok": True, "tool": name})
+
+    # One candidate's interview, one turn after the other as in the app
+    def run_candidate(self, number, delay):
+        time.sleep(delay)
+        rng = random.Random(number)
+        thread_id = None
+        for step, prompt, _ in self.scripts[number]:
+            if thread_id is not None and self.think_time:
+                time.sleep(rng.uniform(0, self.think_time))
+
+            start = timeit.default_timer()
+            turn = {"candidate": number, "step": step}
+            try:
+                result = run_turn(
+                    self.client,
+                    ASSISTANT_ID,
+                    thread_id,
+                    prompt,
+                    ADDITIONAL_INSTRUCTIONS,
+                    tool_handler=self.tool_handler,
+                    stream=self.stream,
+                    start=start,
+                    deadline=self.deadline,
+                )
+                thread_id = result["thread_id"]
+                if result["fallback"]:
+                    turn["outcome"] = "fallback"
+                elif result["status"] == "completed" and result["response"]:
+                    turn["outcome"] = "completed"
+                else:
+                    turn["outcome"] = result["status"] or "no_response"
+                turn["time_to_first_token"] = result["time_to_first_token"]
+            except Exception as error:
+                turn["outcome"] = "error"
+                turn["error"] = f"{type(error).__name__}: {error}"
+            turn["duration"] = timeit.default_timer() - start
+            with self._lock:
+                self.turns.append(turn)
+
+    def run(self, ramp_up=0.0):
+        numbers = sorted(self.scripts)
+        with ThreadPoolExecutor(max_workers=max(1, len(numbers))) as executor:
+            futures = [
+                executor.submit(self.run_candidate, number, ramp_up * index / max(1, len(numbers)))
+                for index, number in enumerate(numbers)
+            ]
+            for future in futures:
+                future.result()
+
+    def report(self, wall_time, started_at, counters_before):
+        completed = [turn for turn in self.turns if turn["outcome"] == "completed"]
+        outcomes = {}
+        errors = {}
+        for turn in self.turns:
+            outcomes[turn["outcome"]] = outcomes.get(turn["outcome"], 0) + 1
+            if "error" in turn:
+                errors[turn["error"]] = errors.get(turn["error"], 0) + 1
+        interviews = sum(
+            1 for number in self.scripts
+            if all(turn["outcome"] == "completed" for turn in self.turns if turn["candidate"] == number)
+        )
+        after = counters()
+
+        return {
+            "candidates": len(self.scripts),
+            "turns": len(self.turns),
+            "wall_time": wall_time,
+            "turns_per_second": len(completed) / wall_time if wall_time else None,
+            "interviews_completed": interviews,
+            "interviews_per_minute": 60 * interviews / wall_time if wall_time else None,
+            "outcomes": outcomes,
+            "errors": errors,
+            "turn": _summary([turn["duration"] for turn in completed]),
+            "time_to_first_token": _summary([
+                turn["time_to_first_token"] for turn in completed if turn.get("time_to_first_token") is not None
+            ]),
+            "turn_by_step": {
+                step: _summary([turn["duration"] for turn in completed if turn["step"] == step])
+                for step in SCRIPT_STEPS
+            },
+            "stages": {stage: _summary(values) for stage, values in sorted(_span_durations(started_at).items())},
+            "counters": {name: value - counters_before.get(name, 0) for name, value in after.items()
+                         if value != counters_before.get(name, 0)},
+        }
+
+
+def _print_summary(name, summary):
+    if not summary.get("count"):
+        return
+    print(
+        f"  {name:<22} {summary['count']:>6}  p50 {summary['p50']:.3f}s  p95 {summary['p95']:.3f}s  "
+        f"p99 {summary['p99']:.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run scripted interviews against a mock of the Assistants API.")
+    parser.add_argument("--candidates", type=int, default=50, help="simulated candidates, all in flight at once")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="seconds over which the candidates start")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="up to this many seconds between a reply and the next message")
+    parser.add_argument("--no-stream", action="store_true", help="poll the runs instead of streaming them")
+    parser.add_argument("--deadline", type=float, default=TURN_DEADLINE_SECONDS, help="turn deadline in seconds")
+    parser.add_argument("--tool-latency", type=float, default=0.0, help="seconds each function call takes")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--base-url", help="an already running mock_assistants.py, e.g. http://127.0.0.1:8765/v1")
+    mock_options = parser.add_argument_group("in-process mock")
+    mock_options.add_argument("--queue-latency", type=float, default=0.2)
+    mock_options.add_argument("--run-latency", type=float, default=1.0)
+    mock_options.add_argument("--request-latency", type=float, default=0.02)
+    mock_options.add_argument("--failure-rate", type=float, default=0.0)
+    mock_options.add_argument("--stall-rate", type=float, default=0.0)
+    mock_options.add_argument("--reply-words", type=int, default=60, help="words in each reply")
+    parser.add_argument("--output", help="results file (default: bench_results/load_<timestamp>.json)")
+    args = parser.parse_args()
+
+    test = None
+    base_url = args.base_url
+    mock = None
+    if base_url is None:
+        reply_words = args.reply_words
+        config = MockConfig(
+            queue_latency=args.queue_latency,
+            run_latency=args.run_latency,
+            request_latency=args.request_latency,
+            failure_rate=args.failure_rate,
+            stall_rate=args.stall_rate,
+            reply=lambda prompt: " ".join(["palabra"] * reply_words),
+            tool_calls=lambda prompt: test.mock_tool_calls(prompt),
+        )
+        mock, base_url = start_mock_server(config)
+
+    client = OpenAI(base_url=base_url, api_key=os.getenv("OPENAI_API_KEY") or "mock")
+    test = LoadTest(
+        client,
+        stream=not args.no_stream,
+        think_time=args.think_time,
+        tool_latency=args.tool_latency,
+        deadline=args.deadline,
+        seed=args.seed,
+    )
+    test.add_candidates(args.candidates)
+
+    print(f"{args.candidates} candidates, {len(SCRIPT_STEPS)} turns each, against {base_url}")
+    started_at = time.time()
+    counters_before = counters()
+    start = timeit.default_timer()
+    test.run(args.ramp_up)
+    wall_time = timeit.default_timer() - start
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+        "revision": git_revision(),
+        "options": vars(args),
+    }
+    report.update(test.report(wall_time, started_at, counters_before))
+    if mock is not None:
+        report["mock_requests"] = mock.request_count
+
+    print(
+        f"{report['turns']} turns in {wall_time:.1f}s: {report['turns_per_second']:.2f} completed turns/s, "
+        f"{report['interviews_completed']} interviews completed ({report['interviews_per_minute']:.1f}/min)"
+    )
+    print(f"  outcomes: {json.dumps(report['outcomes'])}")
+    _print_summary("turn", report["turn"])
+    _print_summary("time_to_first_token", report["time_to_first_token"])
+    for step, summary in report["turn_by_step"].items():
+        _print_summary(f"turn:{step}", summary)
+    for stage, summary in report["stages"].items():
+        _print_summary(stage, summary)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"load_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
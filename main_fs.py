@@ -1,25 +1,56 @@
 import streamlit as st
-from openai import OpenAI
+from openai import AuthenticationError, NotFoundError
 import os
 from dotenv import load_dotenv
-import re  # Import regex for string cleaning
 import timeit
+from candidate_facts import facts_summary, update_facts
+from cdc_watcher import start_catalog_watcher
+from chat_turn import CHAT_THREAD_TURNS, last_turns_truncation, request_turn, run_turn, strip_citations
+from resources import (
+    call_catalog_tool,
+    get_assistant,
+    get_catalog,
+    get_client,
+    get_response_cache,
+    invalidate,
+)
+from turn_metrics import record_span, span, start_metrics_server
+from warm_threads import get_warm_thread_pool
 
 # Load environment variables
 load_dotenv(override=True)
 
-# Initialize OpenAI client
-client = OpenAI()
+# Render the assistant response token by token instead of waiting for the run to complete
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+# Run the turns on the chat service (chat_service.py) instead of calling OpenAI from this process
+CHAT_SERVICE_URL = os.getenv("CHAT_SERVICE_URL")
+# Answer repeated opening questions about the catalog from earlier responses
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
+# Windowing mode for long interviews: render the last CHAT_RENDER_MESSAGES messages (older ones
+# on demand), let each run read the last CHAT_THREAD_TURNS turns of the thread and send the
+# candidate's facts collected so far with every run
+CONVERSATION_WINDOW = os.getenv("CONVERSATION_WINDOW", "false").lower() in ("1", "true", "yes")
+CHAT_RENDER_MESSAGES = int(os.getenv("CHAT_RENDER_MESSAGES", "20"))
 
-# Retrieve the vector store and assistant
-vector_store = client.beta.vector_stores.retrieve(vector_store_id=os.getenv("VECTOR_STORE_ID"))
-assistant = client.beta.assistants.retrieve(assistant_id=os.getenv("ASST_ID"))
+# Get the cached OpenAI client and assistant (with the vector store attached).
+# These are built once per worker, not on every rerun.
+if not CHAT_SERVICE_URL:
+    client = get_client()
+    assistant = get_assistant()
+    # Empty threads for new interviews, None unless WARM_THREADS is set
+    thread_pool = get_warm_thread_pool(get_client)
+
+# Serve the per-stage latency summaries for Prometheus
+start_metrics_server()
+
+# Apply catalog changes from the database as they happen instead of every CATALOG_TTL seconds
+if os.getenv("CDC_WATCH", "false").lower() in ("1", "true", "yes"):
+    start_catalog_watcher()
 
-# Update the assistant to use the vector store
-assistant = client.beta.assistants.update(
-    assistant_id=assistant.id,
-    tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
-)
+
+# Answer the assistant's function calls from the in-memory catalog
+def tool_handler(name, arguments, thread_id=None):
+    return call_catalog_tool(name, arguments, thread_id=thread_id)
 
 # Streamlit App
 st.title("Chat with Your Assistant 🤖")
@@ -29,11 +60,28 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "thread_id" not in st.session_state:
     st.session_state.thread_id = None
+# Messages answered from the response cache, added to the thread with the next run
+if "pending_messages" not in st.session_state:
+    st.session_state.pending_messages = []
+
+# Facts the candidate gave so far and older messages revealed, for the windowing mode
+if "facts" not in st.session_state:
+    st.session_state.facts = {}
+if "revealed_messages" not in st.session_state:
+    st.session_state.revealed_messages = 0
 
-# Display chat history
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+# Display chat history, only the most recent messages in windowing mode
+with span("history_render") as labels:
+    history = st.session_state.messages
+    if CONVERSATION_WINDOW:
+        hidden = len(history) - CHAT_RENDER_MESSAGES - st.session_state.revealed_messages
+        if hidden > 0 and st.button(f"Show earlier messages ({hidden} hidden)"):
+            st.session_state.revealed_messages += CHAT_RENDER_MESSAGES
+        history = history[-(CHAT_RENDER_MESSAGES + st.session_state.revealed_messages):]
+    labels["messages"] = len(history)
+    for message in history:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
 
 # User input
 if prompt := st.chat_input("What would you like to ask?"):
@@ -44,60 +92,97 @@ if prompt := st.chat_input("What would you like to ask?"):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Create a thread if it doesn't exist
-    if st.session_state.thread_id is None:
-        thread = client.beta.threads.create()
-        st.session_state.thread_id = thread.id
-        thread_id = thread.id  # Define thread_id here
-    else:
-        thread_id = st.session_state.thread_id  # Use existing thread_id
-
-    # Add the user's message to the thread
-    client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=prompt
-    )
+    # Remember the thread as soon as it is created
+    def on_thread_created(thread_id):
+        st.session_state.thread_id = thread_id
 
     try:
         # Create and poll the run
         candidate_identifier = "28364655923149842"
         
         if len(candidate_identifier) < 16:
-            run = client.beta.threads.runs.create_and_poll(
-            thread_id=thread_id,
-            assistant_id=assistant.id,
-            additional_instructions=""". Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
-        )
+            additional_instructions = """. Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
         else:
-            run = client.beta.threads.runs.create_and_poll(
-                thread_id=thread_id,
-                assistant_id=assistant.id,
-                additional_instructions="""and phone number. Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
-            )
-
-        # Check if the run completed successfully
-        if run.status == 'completed':
-            stop = timeit.default_timer()
-            print("Time: ", stop - start)
-
-            # Retrieve the assistant's response
-            messages = list(client.beta.threads.messages.list(thread_id=thread_id))
-            if messages:
-                for message in messages:
-                    if message.role == "assistant":
-                        assistant_response = message.content[0].text.value
-                        # Remove citations using regex
-                        assistant_response = re.sub(r"【.*?】", "", assistant_response).strip()
-                        break
+            additional_instructions = """and phone number. Make sure to gently ask questions again if the user ignores them until you have everything.  If they try to change the topic, redirect the conversation to the main interview script."""
+
+        thread_turns = 0
+        if CONVERSATION_WINDOW:
+            # Older turns drop out of the run's context, the facts from them are sent along instead
+            try:
+                catalog = get_catalog()
+            except Exception as error:
+                print(f"Catalog not available for the candidate facts: {error}")
+                catalog = None
+            update_facts(st.session_state.facts, prompt, catalog)
+            summary = facts_summary(st.session_state.facts)
+            if summary:
+                additional_instructions += " " + summary
+            thread_turns = CHAT_THREAD_TURNS
+
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
 
+            if CHAT_SERVICE_URL:
+                # The service runs the whole turn, the reply arrives in one piece
+                with st.spinner("..."):
+                    result = request_turn(
+                        CHAT_SERVICE_URL,
+                        st.session_state.thread_id,
+                        prompt,
+                        additional_instructions,
+                        pending_messages=st.session_state.pending_messages,
+                        thread_turns=thread_turns,
+                    )
+                on_thread_created(result["thread_id"])
+            else:
+                # Stream the run, rendering the text as it arrives, or wait for it to complete
+                result = run_turn(
+                    client,
+                    assistant.id,
+                    st.session_state.thread_id,
+                    prompt,
+                    additional_instructions,
+                    tool_handler=tool_handler,
+                    stream=STREAM_RESPONSES,
+                    on_text=lambda text: placeholder.markdown(text + "▌"),
+                    on_thread_created=on_thread_created,
+                    start=start,
+                    assistant_instructions=assistant.instructions,
+                    response_cache=get_response_cache() if RESPONSE_CACHE else None,
+                    pending_messages=st.session_state.pending_messages,
+                    truncation_strategy=last_turns_truncation(thread_turns),
+                    thread_pool=thread_pool,
+                )
+            st.session_state.pending_messages = result["pending_messages"]
+            status = result["status"]
+            print("Time to first token: ", result["time_to_first_token"])
+            print("Time: ", result["total_time"])
+            print("Round-trips saved: ", result["round_trips_saved"], "(cached)" if result["cached"] else "")
+
+            if result["fallback"]:
+                print("Turn answered with the fallback reply, last run status: ", status)
+
+            # The fallback reply stands in for a run that did not complete in time
+            if (status == 'completed' or result["fallback"]) and result["response"]:
+                with span("render", thread_id=result["thread_id"], run_id=result["run_id"]):
+                    # Remove citations
+                    assistant_response = strip_citations(result["response"])
+                    placeholder.markdown(assistant_response)
                 # Add assistant's response to chat history
                 st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-                with st.chat_message("assistant"):
-                    st.markdown(assistant_response)
-            else:
+            elif status == 'completed':
+                placeholder.empty()
                 st.error("No response from the assistant.")
-        else:
-            st.error(f"Run did not complete successfully. Status: {run.status}")
+            else:
+                placeholder.empty()
+                st.error(f"Run did not complete successfully. Status: {status}")
+
+        # Whole turn, from the prompt to the rendered response. run_turn records it when the
+        # turn runs here, the service records its own.
+        if CHAT_SERVICE_URL:
+            record_span("turn", timeit.default_timer() - start, result["thread_id"], result["run_id"])
     except Exception as e:
+        # The cached assistant or client may be stale, fetch them again on the next interaction
+        if isinstance(e, (AuthenticationError, NotFoundError)):
+            invalidate()
         st.error(f"An error occurred: {e}")
\ No newline at end of file
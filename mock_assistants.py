@@ -0,0 +1,473 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from aiohttp import web
+
+
+# Local stand-in for the OpenAI Assistants threads/messages/runs endpoints.
+# Point a client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 (any API key)
+# to exercise the chat turn code without spending tokens.
+#
+# Runs stay queued for queue_latency seconds, in progress for run_latency seconds
+# and then complete with a reply from reply(prompt). A failure_rate share of the
+# runs fail instead and a stall_rate share never finish unless cancelled.
+# Streaming runs send the reply as server-sent events. With tool_calls set, runs
+# first stop in requires_action for the function calls it returns. As in the API,
+# a thread takes no new run or message while it has a run that has not finished.
+#
+#   python mock_assistants.py --port 8765 --run-latency 1.5 --failure-rate 0.01
+
+
+class MockConfig:
+    def __init__(self, queue_latency=0.2, run_latency=1.0, failure_rate=0.0,
+                 request_latency=0.02, stream_chunk_delay=0.02, poll_after_ms=50, reply=None, tool_calls=None,
+                 stall_rate=0.0):
+        self.queue_latency = queue_latency
+        self.run_latency = run_latency
+        self.failure_rate = failure_rate
+        # Share of the runs that stay in progress until they are cancelled
+        self.stall_rate = stall_rate
+        self.request_latency = request_latency
+        self.stream_chunk_delay = stream_chunk_delay
+        self.poll_after_ms = poll_after_ms
+        self.reply = reply or (lambda prompt: f"Recibido: {prompt}")
+        # tool_calls(prompt) returns the [(name, arguments), ...] a run asks for before
+        # replying, the run stops in requires_action until their outputs are submitted
+        self.tool_calls = tool_calls
+
+
+_ids = itertools.count(1)
+
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action", "cancelling")
+
+
+def _new_id(prefix):
+    return f"{prefix}_mock{next(_ids)}"
+
+
+def _message(thread_id, role, text, run_id=None, assistant_id=None):
+    return {
+        "id": _new_id("msg"),
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "run_id": run_id,
+        "assistant_id": assistant_id,
+        "role": role,
+        "status": "completed",
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        "attachments": [],
+        "metadata": {},
+    }
+
+
+def _content_text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+class MockAssistants:
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.threads = {}
+        self.runs = {}
+        self.request_count = 0
+
+    # Thread, message and run objects
+
+    def create_thread(self, messages=()):
+        thread = {"id": _new_id("thread"), "object": "thread", "created_at": int(time.time()),
+                  "metadata": {}, "tool_resources": None}
+        self.threads[thread["id"]] = {"thread": thread, "messages": [], "runs": []}
+        for message in messages:
+            self.add_message(thread["id"], message.get("role", "user"), _content_text(message["content"]))
+        return thread
+
+    def add_message(self, thread_id, role, text, run_id=None, assistant_id=None):
+        message = _message(thread_id, role, text, run_id, assistant_id)
+        self.threads[thread_id]["messages"].append(message)
+        return message
+
+    def create_run(self, thread_id, body):
+        for message in body.get("additional_messages") or []:
+            self.add_message(thread_id, message.get("role", "user"), _content_text(message["content"]))
+
+        user_messages = [m for m in self.threads[thread_id]["messages"] if m["role"] == "user"]
+        prompt = user_messages[-1]["content"][0]["text"]["value"] if user_messages else ""
+
+        run = {
+            "id": _new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": body.get("assistant_id"),
+            "status": "queued",
+            "started_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "cancelled_at": None,
+            "expired_at": None,
+            "last_error": None,
+            "required_action": None,
+            "model": "mock",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+            "usage": None,
+            "truncation_strategy": body.get("truncation_strategy"),
+        }
+        self.runs[run["id"]] = {
+            "run": run,
+            "start": time.monotonic(),
+            "fails": random.random() < self.config.failure_rate,
+            "stalls": random.random() < self.config.stall_rate,
+            "reply": self.config.reply(prompt),
+            "message": None,
+            "tool_calls": [
+                {"id": _new_id("call"), "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(arguments)}}
+                for name, arguments in (self.config.tool_calls(prompt) if self.config.tool_calls else [])
+            ],
+            "tool_outputs": None,
+            # A stream is sending the run's events, it moves the run along instead of refresh_run
+            "streaming": False,
+        }
+        self.threads[thread_id]["runs"].append(run["id"])
+        return run
+
+    # The thread's run that has not finished yet, None if there is none
+    def active_run(self, thread_id):
+        runs = self.threads[thread_id]["runs"]
+        if runs and self.refresh_run(runs[-1])["status"] in ACTIVE_RUN_STATUSES:
+            return self.runs[runs[-1]]["run"]
+        return None
+
+    # Stop the run for its function calls, if it has any left to answer
+    def require_action(self, run_id):
+        state = self.runs[run_id]
+        if not state["tool_calls"] or state["tool_outputs"] is not None:
+            return False
+        state["run"]["status"] = "requires_action"
+        state["run"]["required_action"] = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {"tool_calls": state["tool_calls"]},
+        }
+        return True
+
+    # Take the outputs and run again for run_latency
+    def submit_tool_outputs(self, run_id, tool_outputs):
+        state = self.runs[run_id]
+        run = state["run"]
+        if run["status"] != "requires_action":
+            return None
+        expected = {tool_call["id"] for tool_call in state["tool_calls"]}
+        if {output.get("tool_call_id") for output in tool_outputs} != expected:
+            return None
+        state["tool_outputs"] = tool_outputs
+        state["start"] = time.monotonic() - self.config.queue_latency
+        run["status"] = "queued"
+        run["required_action"] = None
+        return run
+
+    # Move the run along its lifecycle according to the configured latencies
+    def refresh_run(self, run_id):
+        state = self.runs[run_id]
+        run = state["run"]
+        if run["status"] in ("completed", "failed", "cancelled", "expired", "requires_action"):
+            return run
+
+        elapsed = time.monotonic() - state["start"]
+        now = int(time.time())
+        if run["status"] == "cancelling":
+            run["status"] = "cancelled"
+            run["cancelled_at"] = now
+        elif state["streaming"]:
+            pass
+        elif elapsed < self.config.queue_latency:
+            run["status"] = "queued"
+        elif self.require_action(run_id):
+            pass
+        elif state["stalls"] or elapsed < self.config.queue_latency + self.config.run_latency:
+            run["status"] = "in_progress"
+            run["started_at"] = run["started_at"] or now
+        else:
+            self.finish_run(run_id)
+        return run
+
+    # Fail or complete the run, adding the reply (or the given streamed message) to the thread
+    def finish_run(self, run_id, message=None):
+        state = self.runs[run_id]
+        run = state["run"]
+        now = int(time.time())
+        run["started_at"] = run["started_at"] or now
+        if state["fails"]:
+            run["status"] = "failed"
+            run["failed_at"] = now
+            run["last_error"] = {"code": "server_error", "message": "Mock failure"}
+            return run
+
+        run["status"] = "completed"
+        run["completed_at"] = now
+        if message is None:
+            message = _message(run["thread_id"], "assistant", state["reply"], run_id, run["assistant_id"])
+        self.threads[run["thread_id"]]["messages"].append(message)
+        state["message"] = message
+        return run
+
+    # HTTP handlers
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.request_count += 1
+        if self.config.request_latency:
+            await asyncio.sleep(self.config.request_latency)
+        response = await handler(request)
+        response.headers["openai-poll-after-ms"] = str(self.config.poll_after_ms)
+        return response
+
+    def _thread(self, request):
+        thread_id = request.match_info["thread_id"]
+        if thread_id not in self.threads:
+            raise web.HTTPNotFound(text=json.dumps({"error": {"message": f"No thread found with id '{thread_id}'."}}),
+                                   content_type="application/json")
+        return thread_id
+
+    def _run(self, request):
+        thread_id = self._thread(request)
+        run_id = request.match_info["run_id"]
+        if run_id not in self.runs or self.runs[run_id]["run"]["thread_id"] != thread_id:
+            raise web.HTTPNotFound(text=json.dumps({"error": {"message": f"No run found with id '{run_id}'."}}),
+                                   content_type="application/json")
+        return run_id
+
+    async def handle_create_thread(self, request):
+        body = await request.json() if request.can_read_body else {}
+        return web.json_response(self.create_thread(body.get("messages") or []))
+
+    async def handle_delete_thread(self, request):
+        thread_id = self._thread(request)
+        del self.threads[thread_id]
+        return web.json_response({"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    def _no_active_run(self, thread_id):
+        run = self.active_run(thread_id)
+        if run is not None:
+            raise web.HTTPBadRequest(
+                text=json.dumps({"error": {"message": f"Thread {thread_id} already has an active run {run['id']}."}}),
+                content_type="application/json",
+            )
+
+    async def handle_create_message(self, request):
+        thread_id = self._thread(request)
+        self._no_active_run(thread_id)
+        body = await request.json()
+        return web.json_response(self.add_message(thread_id, body.get("role", "user"), _content_text(body["content"])))
+
+    async def handle_list_messages(self, request):
+        thread_id = self._thread(request)
+        messages = self.threads[thread_id]["messages"]
+        run_id = request.query.get("run_id")
+        if run_id:
+            messages = [m for m in messages if m["run_id"] == run_id]
+        if request.query.get("order", "desc") == "desc":
+            messages = list(reversed(messages))
+        limit = int(request.query.get("limit", "20"))
+        data = messages[:limit]
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(messages) > limit,
+        })
+
+    async def handle_list_runs(self, request):
+        thread_id = self._thread(request)
+        runs = [self.refresh_run(run_id) for run_id in self.threads[thread_id]["runs"]]
+        if request.query.get("order", "desc") == "desc":
+            runs.reverse()
+        limit = int(request.query.get("limit", "20"))
+        data = runs[:limit]
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(runs) > limit,
+        })
+
+    async def handle_create_run(self, request):
+        thread_id = self._thread(request)
+        self._no_active_run(thread_id)
+        body = await request.json()
+        run = self.create_run(thread_id, body)
+        if body.get("stream"):
+            return await self.stream_run(request, run["id"])
+        return web.json_response(run)
+
+    async def handle_create_thread_and_run(self, request):
+        body = await request.json()
+        thread = self.create_thread((body.get("thread") or {}).get("messages") or [])
+        run = self.create_run(thread["id"], body)
+        if body.get("stream"):
+            return await self.stream_run(request, run["id"])
+        return web.json_response(run)
+
+    async def handle_retrieve_run(self, request):
+        return web.json_response(self.refresh_run(self._run(request)))
+
+    async def handle_submit_tool_outputs(self, request):
+        run_id = self._run(request)
+        body = await request.json()
+        run = self.submit_tool_outputs(run_id, body.get("tool_outputs") or [])
+        if run is None:
+            raise web.HTTPBadRequest(
+                text=json.dumps({"error": {"message": "Tool outputs do not match the run's pending tool calls."}}),
+                content_type="application/json",
+            )
+        if body.get("stream"):
+            return await self.stream_run(request, run_id)
+        return web.json_response(run)
+
+    async def handle_cancel_run(self, request):
+        run = self.runs[self._run(request)]["run"]
+        if run["status"] in ("queued", "in_progress", "requires_action"):
+            run["status"] = "cancelling"
+        return web.json_response(run)
+
+    # Send the run lifecycle and the reply in chunks as server-sent events
+    async def stream_run(self, request, run_id):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(event, data):
+            await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+        state = self.runs[run_id]
+        state["streaming"] = True
+        try:
+            run = state["run"]
+            if state["tool_outputs"] is None:
+                await send("thread.run.created", run)
+                await send("thread.run.queued", run)
+                await asyncio.sleep(self.config.queue_latency)
+            run["status"] = "in_progress"
+            run["started_at"] = run["started_at"] or int(time.time())
+            await send("thread.run.in_progress", run)
+
+            if self.require_action(run_id):
+                # The stream ends here, submitting the outputs streams the rest of the run
+                await send("thread.run.requires_action", run)
+            elif state["stalls"]:
+                while run["status"] != "cancelling":
+                    await asyncio.sleep(0.05)
+                await send("thread.run.cancelled", self.refresh_run(run_id))
+            elif state["fails"]:
+                await asyncio.sleep(self.config.run_latency)
+                await send("thread.run.failed", self.finish_run(run_id))
+            else:
+                words = state["reply"].split(" ")
+                message = _message(run["thread_id"], "assistant", "", run_id, run["assistant_id"])
+                message["content"] = []
+                message["status"] = "in_progress"
+                await send("thread.message.created", message)
+
+                # Spread the run latency over the chunks
+                delay = max(self.config.stream_chunk_delay, self.config.run_latency / max(1, len(words)))
+                for index, word in enumerate(words):
+                    await asyncio.sleep(delay)
+                    if run["status"] == "cancelling":
+                        break
+                    text = word if index == 0 else " " + word
+                    await send("thread.message.delta", {
+                        "id": message["id"],
+                        "object": "thread.message.delta",
+                        "delta": {"content": [{"index": 0, "type": "text", "text": {"value": text, "annotations": []}}]},
+                    })
+
+                if run["status"] == "cancelling":
+                    await send("thread.run.cancelled", self.refresh_run(run_id))
+                else:
+                    message = dict(message, status="completed", content=[
+                        {"type": "text", "text": {"value": state["reply"], "annotations": []}}
+                    ])
+                    run = self.finish_run(run_id, message)
+                    await send("thread.message.completed", message)
+                    await send("thread.run.completed", run)
+
+            await response.write(b"event: done\ndata: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client stopped reading, e.g. after its deadline. The run goes on without it.
+            pass
+        finally:
+            state["streaming"] = False
+        return response
+
+    def create_app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes([
+            web.post("/v1/threads", self.handle_create_thread),
+            web.post("/v1/threads/runs", self.handle_create_thread_and_run),
+            web.delete("/v1/threads/{thread_id}", self.handle_delete_thread),
+            web.post("/v1/threads/{thread_id}/messages", self.handle_create_message),
+            web.get("/v1/threads/{thread_id}/messages", self.handle_list_messages),
+            web.get("/v1/threads/{thread_id}/runs", self.handle_list_runs),
+            web.post("/v1/threads/{thread_id}/runs", self.handle_create_run),
+            web.get("/v1/threads/{thread_id}/runs/{run_id}", self.handle_retrieve_run),
+            web.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs", self.handle_submit_tool_outputs),
+            web.post("/v1/threads/{thread_id}/runs/{run_id}/cancel", self.handle_cancel_run),
+        ])
+        return app
+
+
+# Run the mock in a background thread. Returns the mock and its base URL.
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    mock = MockAssistants(config)
+    started = threading.Event()
+    address = {}
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(mock.create_app())
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port)
+        loop.run_until_complete(site.start())
+        address["port"] = site._server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    return mock, f"http://{host}:{address['port']}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Assistants threads/messages/runs endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queue-latency", type=float, default=0.2)
+    parser.add_argument("--run-latency", type=float, default=1.0)
+    parser.add_argument("--request-latency", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        queue_latency=args.queue_latency,
+        run_latency=args.run_latency,
+        request_latency=args.request_latency,
+        failure_rate=args.failure_rate,
+        stall_rate=args.stall_rate,
+    )
+    web.run_app(MockAssistants(config).create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
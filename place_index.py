@@ -0,0 +1,259 @@
+import json
+import os
+import re
+import timeit
+import psycopg2
+from psycopg2 import sql
+from catalog import fold
+from db_pool import pooled_connection
+
+
+# City and state resolver for the names candidates type: "Nuevo Leon", "cdmx", "Edo Mex",
+# "monterey". At export time every city and state with available positions is saved
+# under its folded name (see catalog.fold) and its known aliases; the chat app looks the
+# candidate's text up there, and falls back to names containing its words and to
+# trigram near misses, to get ranked canonical names for find_locations.
+
+PLACE_INDEX_FILE = os.getenv("PLACE_INDEX_FILE", "place_index.json")
+# Trigram similarity (Dice coefficient) below which a near miss is not returned
+PLACE_MIN_SIMILARITY = float(os.getenv("PLACE_MIN_SIMILARITY", "0.5"))
+
+# How candidates write some states and cities, and the name they stand for (both as place_key)
+ALIASES = {
+    "cdmx": "ciudad de mexico",
+    "cd mx": "ciudad de mexico",
+    "cd de mexico": "ciudad de mexico",
+    "df": "ciudad de mexico",
+    "d f": "ciudad de mexico",
+    "distrito federal": "ciudad de mexico",
+    "mexico df": "ciudad de mexico",
+    "edomex": "estado de mexico",
+    "edo mex": "estado de mexico",
+    "edo de mex": "estado de mexico",
+    "edo de mexico": "estado de mexico",
+    "estado de mex": "estado de mexico",
+    "edo mexico": "estado de mexico",
+    "nl": "nuevo leon",
+    "n l": "nuevo leon",
+    "gdl": "guadalajara",
+    "mty": "monterrey",
+    "qro": "queretaro",
+    "qroo": "quintana roo",
+    "q roo": "quintana roo",
+    "slp": "san luis potosi",
+    "bc": "baja california",
+    "bcs": "baja california sur",
+    "ags": "aguascalientes",
+    "gto": "guanajuato",
+    "hgo": "hidalgo",
+    "jal": "jalisco",
+    "mich": "michoacan",
+    "chih": "chihuahua",
+    "chis": "chiapas",
+    "coah": "coahuila",
+    "tamps": "tamaulipas",
+    "tlax": "tlaxcala",
+    "yuc": "yucatan",
+    "zac": "zacatecas",
+    "oax": "oaxaca",
+    "pue": "puebla",
+    "ver": "veracruz",
+    "cd juarez": "ciudad juarez",
+    "neza": "nezahualcoyotl",
+    "playa del carmen": "solidaridad",
+    "los cabos": "cabo san lucas",
+    "pto vallarta": "puerto vallarta",
+}
+
+
+# fold() without punctuation: "Edo. Méx." -> "edo mex"
+def place_key(text):
+    return " ".join(re.sub(r"[^\w]+", " ", fold(text)).split())
+
+
+# Every key of a catalog name: "Ciudad de México (DF - Distrito Federal)" is also "ciudad de mexico"
+def _name_keys(name):
+    keys = {place_key(name), place_key(name.split("(")[0])}
+    keys.discard("")
+    return keys
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlaceIndex:
+    # data: {"places": [[kind, city, state], ...], "keys": {key: [place index, ...]}, "aliases": {alias: key}}
+    def __init__(self, data):
+        self.places = [tuple(place) for place in data["places"]]
+        self.keys = data["keys"]
+        self.aliases = data["aliases"]
+        self.keys_by_word = {}
+        self.keys_by_trigram = {}
+        self.trigram_counts = {}
+        for key in list(self.keys) + list(self.aliases):
+            for word in key.split():
+                self.keys_by_word.setdefault(word, set()).add(key)
+            trigrams = _trigrams(key)
+            self.trigram_counts[key] = len(trigrams)
+            for trigram in trigrams:
+                self.keys_by_trigram.setdefault(trigram, set()).add(key)
+
+    # Index of the (city, state) pairs of the locations. Aliases whose name is not in them are left out.
+    @classmethod
+    def build(cls, city_states):
+        places = []
+        keys = {}
+
+        def add(kind, city, state, names):
+            index = len(places)
+            places.append([kind, city, state])
+            for key in names:
+                keys.setdefault(key, []).append(index)
+
+        states = set()
+        for city, state in sorted(set(city_states), key=lambda pair: (str(pair[1]), str(pair[0]))):
+            if state and state not in states:
+                states.add(state)
+                add("state", None, state, _name_keys(state))
+            if city:
+                add("city", city, state, _name_keys(city))
+
+        aliases = {alias: key for alias, key in ALIASES.items() if key in keys and alias not in keys}
+        return cls({"places": places, "keys": keys, "aliases": aliases})
+
+    # Index of the cities and states of a catalog.Catalog's locations with available positions
+    @classmethod
+    def from_catalog(cls, catalog):
+        return cls.build(
+            (location.city, location.state) for location in catalog.locations.values() if location.position_ids
+        )
+
+    def to_dict(self):
+        return {"places": [list(place) for place in self.places], "keys": self.keys, "aliases": self.aliases}
+
+    def _keys_scored(self, key):
+        if key in self.keys:
+            return {key: (1.0, "exact")}
+        if key in self.aliases:
+            return {self.aliases[key]: (1.0, "alias")}
+
+        scored = {}
+        # Names with all the words typed: "queretaro" -> "santiago de queretaro"
+        words = key.split()
+        containing = set.intersection(*(self.keys_by_word.get(word, set()) for word in words))
+        for name in containing:
+            scored[name] = (0.5 + 0.4 * len(key) / len(name), "partial")
+
+        # Near misses by shared trigrams: "monterey" -> "monterrey"
+        trigrams = _trigrams(key)
+        shared = {}
+        for trigram in trigrams:
+            for name in self.keys_by_trigram.get(trigram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        for name, common in shared.items():
+            similarity = 2 * common / (len(trigrams) + self.trigram_counts[name])
+            if similarity >= PLACE_MIN_SIMILARITY and similarity * 0.95 > scored.get(name, (0,))[0]:
+                scored[name] = (similarity * 0.95, "fuzzy")
+
+        # An alias stands for its name
+        resolved = {}
+        for name, (score, match) in scored.items():
+            name = self.aliases.get(name, name)
+            if score > resolved.get(name, (0,))[0]:
+                resolved[name] = (score, match)
+        return resolved
+
+    # Ranked [{"kind", "city", "state", "match", "score"}, ...] for a city or state as typed.
+    # kind is "city" or "state"; match is "exact", "alias", "partial" or "fuzzy".
+    def resolve(self, text, kind=None, limit=5):
+        key = place_key(text or "")
+        if not key:
+            return []
+        best = {}
+        for name, (score, match) in self._keys_scored(key).items():
+            for index in self.keys[name]:
+                if kind is None or self.places[index][0] == kind:
+                    if score > best.get(index, (0,))[0]:
+                        best[index] = (score, match)
+
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], self.places[item[0]][0] != "state", item[0]))
+        return [
+            {
+                "kind": self.places[index][0],
+                "city": self.places[index][1],
+                "state": self.places[index][2],
+                "match": match,
+                "score": round(score, 3),
+            }
+            for index, (score, match) in ranked[:limit]
+        ]
+
+    # Catalog names for a city and/or state as typed, None for the ones not resolved.
+    # The city is looked for in the resolved state first; a "city" that only resolves
+    # to a state ("Edo Mex") is taken as the state.
+    def resolve_city_state(self, city=None, state=None):
+        resolved_state = None
+        if state:
+            states = self.resolve(state, kind="state", limit=1)
+            resolved_state = states[0]["state"] if states else None
+
+        resolved_city = None
+        if city:
+            # Cities of the state first, then by score, cities before states
+            cities = sorted(
+                self.resolve(city, limit=20),
+                key=lambda c: (c["kind"] != "city" or c["state"] != resolved_state, -c["score"], c["kind"] != "city"),
+            )
+            if cities:
+                if cities[0]["kind"] == "city":
+                    resolved_city = cities[0]["city"]
+                resolved_state = resolved_state or cities[0]["state"]
+        return resolved_city, resolved_state
+
+
+# Cities and states of the active locations with available positions
+def _read_city_states():
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                SELECT DISTINCT l.city, l.state
+                FROM locations l
+                JOIN locations_positions lp ON l.id = lp.location_id
+                JOIN positions p ON lp.position_id = p.id
+                WHERE l.is_active = TRUE
+                  AND p.is_active = TRUE
+                  AND lp.filled_openings < lp.max_openings
+            """))
+            city_states = cursor.fetchall()
+        connection.commit()
+    return city_states
+
+
+# Build the index from an export snapshot (a catalog.Catalog), or from the database, and save it
+def generate_place_index(snapshot=None, filename=PLACE_INDEX_FILE):
+    try:
+        start = timeit.default_timer()
+        if snapshot is not None:
+            index = PlaceIndex.from_catalog(snapshot)
+        else:
+            index = PlaceIndex.build(_read_city_states())
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(index.to_dict(), file, ensure_ascii=False)
+
+        print(
+            f"File '{filename}' generated successfully: {len(index.places)} places, {len(index.keys)} names, "
+            f"{len(index.aliases)} aliases in {timeit.default_timer() - start:.3f}s"
+        )
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error: {error}")
+
+
+# The exported index, None when it has not been generated
+def load_place_index(filename=PLACE_INDEX_FILE):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, encoding="utf-8") as file:
+        return PlaceIndex(json.load(file))
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+from openai import OpenAI
+from catalog import load_catalog, load_catalog_changes
+from catalog_tools import TOOL_NAMES, TOOLS, call_tool
+from place_index import PlaceIndex, load_place_index
+from response_cache import ResponseCache
+from zip_index import load_zip_index
+
+# Shared handles for the OpenAI client, vector store, assistant and catalog.
+# Streamlit re-runs the app script on every interaction, so these are kept at
+# module level and built once per worker process instead of once per rerun.
+
+# Seconds a cached handle is reused before it is fetched again
+RESOURCE_TTL = float(os.getenv("RESOURCE_TTL", "3600"))
+
+# Seconds the in-memory catalog is reused before it is loaded from the database again
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+# Guards _cache and _key_locks only, it is never held while a value is built
+_lock = threading.Lock()
+_cache = {}
+# One lock per key, held while its value is built (or the catalog refreshed), so a
+# value is built once however many callers need it and other keys do not wait for it
+_key_locks = {}
+
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+# Return the cached value for key, building it if it is missing or expired.
+# An expired value is still returned while another caller builds the new one.
+def _cached(key, build, ttl=None):
+    if ttl is None:
+        ttl = RESOURCE_TTL
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[1] < ttl:
+            return entry[0]
+    key_lock = _key_lock(key)
+    if not key_lock.acquire(blocking=entry is None):
+        return entry[0]
+    try:
+        # Another caller may have built it while this one waited
+        with _lock:
+            entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[1] < ttl:
+            return entry[0]
+        value = build()
+        with _lock:
+            _cache[key] = (value, time.monotonic())
+        return value
+    finally:
+        key_lock.release()
+
+
+# Drop cached handles so the next call fetches them again.
+# With no name every handle is dropped, otherwise only the ones of that kind
+# ("client", "vector_store", "assistant", "catalog", "zip_index", "place_index" or "response_cache").
+def invalidate(name=None):
+    with _lock:
+        if name is None:
+            _cache.clear()
+            return
+        for key in [key for key in _cache if key[0] == name]:
+            del _cache[key]
+
+
+def get_client():
+    return _cached(("client",), OpenAI)
+
+
+def get_vector_store(vector_store_id=None):
+    vector_store_id = vector_store_id or os.getenv("VECTOR_STORE_ID")
+    return _cached(
+        ("vector_store", vector_store_id),
+        lambda: get_client().beta.vector_stores.retrieve(vector_store_id=vector_store_id),
+    )
+
+
+# Retrieve the assistant, attaching the vector store and the catalog tools
+# only if they are not attached already
+def get_assistant(assistant_id=None, vector_store_id=None):
+    assistant_id = assistant_id or os.getenv("ASST_ID")
+    vector_store_id = vector_store_id or os.getenv("VECTOR_STORE_ID")
+
+    def build():
+        client = get_client()
+        vector_store = get_vector_store(vector_store_id)
+        assistant = client.beta.assistants.retrieve(assistant_id=assistant_id)
+
+        attached = []
+        if assistant.tool_resources and assistant.tool_resources.file_search:
+            attached = assistant.tool_resources.file_search.vector_store_ids or []
+
+        functions = [tool.function.name for tool in assistant.tools if tool.type == "function"]
+
+        if vector_store.id not in attached or sorted(functions) != sorted(TOOL_NAMES):
+            print(f"Attaching vector store {vector_store.id} and catalog tools to assistant {assistant.id}")
+            # Keep any other tools the assistant has, replace the function ones
+            tools = [tool.model_dump(exclude_none=True) for tool in assistant.tools if tool.type != "function"]
+            if not any(tool["type"] == "file_search" for tool in tools):
+                tools.append({"type": "file_search"})
+            assistant = client.beta.assistants.update(
+                assistant_id=assistant.id,
+                tools=tools + TOOLS,
+                tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
+            )
+        return assistant
+
+    return _cached(("assistant", assistant_id, vector_store_id), build)
+
+
+def get_catalog():
+    return _cached(("catalog",), load_catalog, ttl=CATALOG_TTL)
+
+
+# Apply a batch of database changes (see cdc_watcher.py) to the cached catalog in place of
+# a full reload. Nothing to do when no catalog is cached, the next get_catalog() loads it.
+# Readers keep getting the cached catalog while the changes are read.
+def refresh_catalog(location_ids=(), position_ids=()):
+    with _key_lock(("catalog",)):
+        with _lock:
+            entry = _cache.get(("catalog",))
+        if entry is None:
+            return None
+        catalog = load_catalog_changes(entry[0], location_ids, position_ids)
+        with _lock:
+            # Dropped by invalidate() in the meantime, the next get_catalog() loads it
+            if _cache.get(("catalog",)) is not entry:
+                return None
+            # The load time is kept, the TTL reload stays as a safety net
+            _cache[("catalog",)] = (catalog, entry[1])
+        return catalog
+
+
+# None when the nearest locations file has not been generated
+def get_zip_index():
+    return _cached(("zip_index",), load_zip_index, ttl=CATALOG_TTL)
+
+
+# Built from the catalog when the exporter has not generated the place index file
+def get_place_index():
+    return _cached(
+        ("place_index",), lambda: load_place_index() or PlaceIndex.from_catalog(get_catalog()), ttl=CATALOG_TTL
+    )
+
+
+# Entries expire on their own and when the catalog snapshot changes, the cache itself is kept
+def get_response_cache():
+    return _cached(("response_cache",), lambda: ResponseCache(get_catalog), ttl=float("inf"))
+
+
+# Output of a function tool call with the cached catalog and indexes. When they cannot be
+# loaded (database down, unreadable index file) the assistant gets an error output instead
+# of the turn failing; save_candidate does not need them.
+def call_catalog_tool(name, arguments, thread_id=None):
+    if name == "save_candidate":
+        return call_tool(None, name, arguments, thread_id=thread_id)
+    try:
+        catalog, zip_index, place_index = get_catalog(), get_zip_index(), get_place_index()
+    except Exception as error:
+        print(f"Error loading the catalog for {name}: {error}")
+        return json.dumps({"error": "The catalog is not available right now, try again in a moment"})
+    return call_tool(catalog, name, arguments, zip_index=zip_index, thread_id=thread_id, place_index=place_index)
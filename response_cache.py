@@ -0,0 +1,98 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from catalog import fold
+from turn_metrics import count
+
+
+# Cache of assistant responses to questions the catalog answers, such as the
+# details of a position or the stores in a city. Keys are the normalized question
+# plus the catalog snapshot hash, so a data refresh invalidates every entry.
+#
+# Only a thread's opening question is cached: nothing about the candidate is in
+# the thread yet, so the response cannot leak one candidate's data to another.
+
+# Maximum number of cached responses, the least recently used go first
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Seconds a cached response is served
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+# Digits and emails are candidate data (age, phone, zip code), not catalog questions
+PERSONAL_DATA = re.compile(r"\d|@")
+
+
+# Lowercase, no accents, no punctuation, single spaces
+def normalize_question(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", fold(text)).split())
+
+
+class ResponseCache:
+    def __init__(self, get_catalog, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.get_catalog = get_catalog
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._snapshot_hash = None
+        # Normalized position, city and state names of the current snapshot
+        self._terms = ()
+
+    def _refresh(self, catalog):
+        if catalog.snapshot_hash == self._snapshot_hash:
+            return
+        terms = {normalize_question(position.name) for position in catalog.positions.values()}
+        for location in catalog.locations.values():
+            terms.add(normalize_question(location.city))
+            terms.add(normalize_question(location.state))
+        terms.discard("")
+        # Entries of the previous snapshot can never be hit again
+        for key in [key for key in self._entries if key[0] != catalog.snapshot_hash]:
+            del self._entries[key]
+        self._terms = tuple(f" {term} " for term in terms)
+        self._snapshot_hash = catalog.snapshot_hash
+
+    # Cache key of a question, or None when the catalog does not answer it
+    def key(self, question):
+        if PERSONAL_DATA.search(question):
+            return None
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        try:
+            catalog = self.get_catalog()
+        except Exception as error:
+            # Without the catalog the question is not looked up, the turn goes to the assistant
+            print(f"Response cache skipped, catalog not available: {error}")
+            count("response_cache_errors")
+            return None
+        with self._lock:
+            self._refresh(catalog)
+            padded = f" {normalized} "
+            if not any(term in padded for term in self._terms):
+                return None
+        return (catalog.snapshot_hash, normalized)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        count("response_cache_hits" if entry is not None else "response_cache_misses")
+        return entry[0] if entry is not None else None
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                count("response_cache_evictions")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,13 +1,41 @@
 import psycopg2
 import json
-from psycopg2 import sql
 import os
+import argparse
+import hashlib
+import itertools
+import re
+import shutil
+import tempfile
+import timeit
+import unicodedata
 from dotenv import load_dotenv
-from openai import OpenAI
+from catalog import Catalog, Location, Position, load_catalog_changes
+from db_pool import pooled_connection, print_pool_stats
+from resources import get_client
+from place_index import generate_place_index
+from zip_index import generate_nearest_locations_by_zip
 
 load_dotenv(override=True)
 
-client = OpenAI()
+# Knowledge file format: "legacy" (the by-state, by-city and positions-by-location
+# files) or "compact" (one file per state group, sized to a single file_search chunk)
+KNOWLEDGE_FORMAT = os.getenv("KNOWLEDGE_FORMAT", "legacy")
+COMPACT_DIR = "knowledge_compact"
+# Tokens per file_search chunk. Compact files are cut to fit in one chunk and
+# uploaded with a static chunking strategy of this size and no overlap.
+KNOWLEDGE_CHUNK_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_TOKENS", "800"))
+# Export through server-side cursors, writing each group as it is read, instead of
+# reading the whole catalog first (see export_knowledge_files_streaming)
+EXPORT_STREAMING = os.getenv("EXPORT_STREAMING", "false").lower() in ("1", "true", "yes")
+# Rows fetched per round-trip by the server-side cursors
+EXPORT_ITERSIZE = int(os.getenv("EXPORT_ITERSIZE", "2000"))
+# Files the compact format replaces
+LEGACY_LOCATION_FILES = [
+    "all_available_locations_by_state.txt",
+    "all_available_locations_by_city.txt",
+    "positions_available_for_locations.txt",
+]
 
 
 # Helper function to save data as JSON
@@ -20,229 +48,267 @@ def save_to_json(data, filename):
 # Function to convert location and position data to a dictionary
 def location_with_positions_to_dict(location, position_data):
     return {
-        "id": location["id"],
-        "name": location["name"],
-        "address": location["address"],
-        "city": location["city"],
-        "state": location["state"],
-        "zip": location["zip"],
-        "phone": location["phone"],
+        "id": location.id,
+        "name": location.name,
+        "address": location.address,
+        "city": location.city,
+        "state": location.state,
+        "zip": location.zip,
+        "phone": location.phone,
         "positions_details": position_data,
     }
     
 def simplified_location_with_positions_to_dict(location, position_data):
     return {
-        "id": location["id"],
-        "name": location["name"],
-        "city": location["city"],
-        "state": location["state"],
-        "zip": location["zip"],
+        "id": location.id,
+        "name": location.name,
+        "city": location.city,
+        "state": location.state,
+        "zip": location.zip,
         "positions_details": position_data,
     }
 
 
 
-# Function to fetch all locations and their associated positions
-def get_all_locations(connection):
+# Read everything the exporters need in a single REPEATABLE READ transaction,
+# so all the knowledge files are generated from the same consistent snapshot.
+# The snapshot is a catalog.Catalog with every active location (or only the ones
+# in the given states or with the given ids), their available positions and openings,
+# and the details of the active positions with openings.
+def read_export_snapshot(connection, states=None, location_ids=None):
+    start = timeit.default_timer()
+    round_trips = 0
+
     try:
         with connection.cursor() as cursor:
-            # Query all active locations
-            cursor.execute(
-                """
-                SELECT id, name, address, city, state, zip, phone, is_active
-                FROM locations
-                WHERE is_active = TRUE
-            """
-            )
-            locations = cursor.fetchall()
-
-            # Query distinct active locations for the "all_available_locations" section
+            # The isolation level is set for this transaction only, so the pooled
+            # connection goes back to the pool with its defaults.
+            # Filter out inactive positions and positions where filled_openings >= max_openings
             cursor.execute(
                 """
-                SELECT DISTINCT id, name, city, state
-                FROM locations
-                WHERE is_active = TRUE
-            """
+                SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;
+                SELECT l.id, l.name, l.address, l.city, l.state, l.zip, l.phone,
+                        lp.position_id, lp.max_openings, lp.filled_openings
+                FROM locations l
+                LEFT JOIN (
+                    locations_positions lp
+                    JOIN positions p ON lp.position_id = p.id
+                        AND p.is_active = TRUE
+                        AND lp.filled_openings < lp.max_openings
+                ) ON lp.location_id = l.id
+                WHERE l.is_active = TRUE
+                {}
+                {}
+                ORDER BY l.id, lp.position_id
+            """.format(
+                    "AND l.state = ANY(%(states)s)" if states is not None else "",
+                    "AND l.id = ANY(%(location_ids)s)" if location_ids is not None else "",
+                ),
+                {"states": list(states or []), "location_ids": list(location_ids or [])},
             )
-            distinct_locations = cursor.fetchall()
+            round_trips += 1
+            # Rows are unpacked straight into the catalog's records
+            snapshot = Catalog()
+            for location_id, name, address, city, state, zip_code, phone, position_id, max_openings, \
+                    filled_openings in cursor:
+                snapshot.add_location(location_id, name, address, city, state, zip_code, phone)
+                # NULL position_id: the location has no available positions
+                if position_id is not None:
+                    snapshot.add_opening(location_id, position_id, max_openings, filled_openings)
 
-            # Query distinct active positions for the "all_available_positions" section
             cursor.execute(
                 """
-                SELECT DISTINCT p.id, p.name
+                SELECT DISTINCT
+                    lp.position_id, 
+                    p.name, 
+                    p.description, 
+                    p.key_responsibilities, 
+                    p.qualifications, 
+                    p.benefits, 
+                    p.salary_range,
+                    p.salary_currency, 
+                    p.salary_period, 
+                    p.job_type, 
+                    p.location_type
                 FROM positions p
                 JOIN locations_positions lp ON p.id = lp.position_id
                 WHERE p.is_active = TRUE
-                AND lp.filled_openings < lp.max_openings
+                  AND lp.filled_openings < lp.max_openings
+                ORDER BY lp.position_id
             """
             )
-            distinct_positions = cursor.fetchall()
+            round_trips += 1
+            for row in cursor:
+                snapshot.add_position(*row)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+
+    print(f"Export snapshot read: {round_trips} round-trips in {timeit.default_timer() - start:.3f}s")
+    return snapshot
+
+
+# Read a snapshot with a pooled connection, for exporters called on their own
+def read_export_snapshot_standalone(states=None):
+    with pooled_connection() as connection:
+        return read_export_snapshot(connection, states)
+
+
+# The snapshot with the rows of the changed locations, and of the ones linked to the
+# changed positions, read again (see catalog.load_catalog_changes). The result is the
+# snapshot read_export_snapshot would return now.
+def update_export_snapshot(snapshot, location_ids=(), position_ids=(), connection=None):
+    return load_catalog_changes(
+        snapshot,
+        location_ids,
+        position_ids,
+        connection,
+        read_catalog=lambda connection, affected: read_export_snapshot(connection, location_ids=affected),
+    )
 
-            locations_data = []
-            simplified_locations_data = []
-            locations_by_cities = {}
-            locations_by_states = {}
 
-            for location in locations:
-                location_dict = {
-                    "id": location[0],
-                    "name": location[1],
-                    "address": location[2],
-                    "city": location[3],
-                    "state": location[4],
-                    "zip": location[5],
-                    "phone": location[6],
-                }
-                
-                simplified_location_dict = {
-                    "id": location[0],
-                    "name": location[1],
-                    "city": location[3],
-                    "state": location[4],
-                    "zip": location[5]
-                }
+# Active locations with at least one available position, in snapshot order
+def locations_with_available_positions(snapshot):
+    return [location for location in snapshot.locations.values() if location.position_ids]
 
-                # Query positions associated with the current location
-                # Filter out inactive positions and positions where filled_openings >= max_openings
-                cursor.execute(
-                    """
-                    SELECT lp.position_id, p.name, p.description, p.key_responsibilities, p.qualifications, p.benefits, p.salary_range,
-                            p.salary_currency, p.salary_period, p.job_type, p.location_type, p.is_active, lp.max_openings, lp.filled_openings
-                    FROM locations_positions lp
-                    JOIN positions p ON lp.position_id = p.id
-                    WHERE lp.location_id = %s
-                    AND p.is_active = TRUE
-                    AND lp.filled_openings < lp.max_openings
-                """,
-                    (location[0],),
-                )
-                positions_locations = cursor.fetchall()
-
-                position_data = [
-                    {
-                        "position_id": pl[0],
-                        "name": pl[1],
-                        "description": pl[2],
-                        "key_responsibilities": pl[3],
-                        "qualifications": pl[4],
-                        "benefits": pl[5],
-                        "salary_range": pl[6],
-                        "salary_currency": pl[7],
-                        "salary_period": pl[8],
-                        "job_type": pl[9],
-                        "location_type": pl[10],
-                        "max_openings": pl[12],
-                        "filled_openings": pl[13],
-                    }
-                    for pl in positions_locations
-                ]
-                
-                
-                simplified_position_data = [
-                    {
-                        "position_id": pl[0],
-                        "name": pl[1]
-                    }
-                    for pl in positions_locations
-                ]
-
-                # Append location data with associated positions
-                locations_data.append(
-                    location_with_positions_to_dict(location_dict, position_data)
-                )
 
-                simplified_locations_data.append(
-                    simplified_location_with_positions_to_dict(simplified_location_dict, simplified_position_data)
-                )
-                
-                # Group locations by city
-                city = location[3]
-                if city not in locations_by_cities:
-                    locations_by_cities[city] = []
-                locations_by_cities[city].append(
-                    {
-                        "id": location[0],
-                        "name": location[1],
-                        "address": location[2],
-                        "state": location[4],
-                        "zip": location[5]
-                    }
-                )
+# Function to fetch all locations and their associated positions
+def get_all_locations(connection=None, snapshot=None):
+    try:
+        if snapshot is None:
+            if connection is None:
+                snapshot = read_export_snapshot_standalone()
+            else:
+                snapshot = read_export_snapshot(connection)
+
+        positions = snapshot.positions
+        locations_by_cities = {}
+        locations_by_states = {}
+        locations_data = []
+        simplified_locations_data = []
+
+        # Every structure is built from the catalog's records in a single pass
+        for location in snapshot.locations.values():
+            # Group locations by city
+            locations_by_cities.setdefault(location.city, []).append(
+                {
+                    "id": location.id,
+                    "name": location.name,
+                    "address": location.address,
+                    "state": location.state,
+                    "zip": location.zip
+                }
+            )
 
-                # Group locations by state
-                state = location[4]
-                if state not in locations_by_states:
-                    locations_by_states[state] = []
-                locations_by_states[state].append(
-                    {
-                        "id": location[0],
-                        "name": location[1],
-                        "address": location[2],
-                        "city": location[3],
-                        "zip": location[5]
-
-                    }
-                )
+            # Group locations by state
+            locations_by_states.setdefault(location.state, []).append(
+                {
+                    "id": location.id,
+                    "name": location.name,
+                    "address": location.address,
+                    "city": location.city,
+                    "zip": location.zip
+                }
+            )
 
-            # Prepare the final JSON structure
-            available_locations_and_positions = {
-                "all_available_positions": [
-                    {"id": pos[0], "name": pos[1]} for pos in distinct_positions
-                ],
-                "all_available_locations": [
-                    {"id": loc[0], "name": loc[1], "city": loc[2], "state": loc[3]}
-                    for loc in distinct_locations
-                ],
-                "locations_by_city": [
-                   {city: locations} for city, locations in locations_by_cities.items()
-                ],
-                "locations_by_state": [
-                   {state: locations}
-                   for state, locations in locations_by_states.items()
-                ],
-                "list_of_locations_with_positions_available": simplified_locations_data
-            }
-
-            locations_and_positions_details = {"locations_details": locations_data}
-
-            return available_locations_and_positions, locations_and_positions_details
+            position_data = []
+            simplified_position_data = []
+            for position_id, (max_openings, filled_openings) in zip(location.position_ids, location.openings):
+                position = positions[position_id]
+                position_data.append(dict(
+                    position.as_dict(),
+                    max_openings=max_openings,
+                    filled_openings=filled_openings,
+                ))
+                simplified_position_data.append({"position_id": position.position_id, "name": position.name})
+
+            # Append location data with associated positions
+            locations_data.append(location_with_positions_to_dict(location, position_data))
+            simplified_locations_data.append(
+                simplified_location_with_positions_to_dict(location, simplified_position_data)
+            )
+
+        # Prepare the final JSON structure
+        available_locations_and_positions = {
+            "all_available_positions": [
+                {"id": pos.position_id, "name": pos.name} for pos in positions.values()
+            ],
+            "all_available_locations": [
+                {"id": loc.id, "name": loc.name, "city": loc.city, "state": loc.state}
+                for loc in snapshot.locations.values()
+            ],
+            "locations_by_city": [
+               {city: locations} for city, locations in locations_by_cities.items()
+            ],
+            "locations_by_state": [
+               {state: locations}
+               for state, locations in locations_by_states.items()
+            ],
+            "list_of_locations_with_positions_available": simplified_locations_data
+        }
+
+        locations_and_positions_details = {"locations_details": locations_data}
+
+        return available_locations_and_positions, locations_and_positions_details
 
     except psycopg2.Error as e:
         print(f"Error fetching all locations: {e}")
         return {}
-    finally:
-        if connection:
-            connection.close()
 
 
-# Main execution
-if __name__ == "__main__":
-    # Database connection parameters
-    conn_params = {
-        "dbname": os.getenv("dbname"),
-        "user": os.getenv("user"),
-        "password": os.getenv("password"),
-        "host": os.getenv("host"),
-        "port": os.getenv("port"),
-    }
+# Local record of the files uploaded to the vector store: content hash -> file id
+VECTOR_STORE_MANIFEST = ".vector_store_manifest.json"
 
-    # Connect to the database
-    conn = psycopg2.connect(**conn_params)
 
-    # Fetch all locations and their positions
-    available_locations_and_positions, locations_and_positions_details = (
-        get_all_locations(conn)
-    )
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # Save the results to JSON files
-#save_to_json(available_locations_and_positions, "all_available_locations_and_positions.json")
-#save_to_json(
-#    locations_and_positions_details, "locations_and_positions_details.json"
-#)
+
+def load_manifest(vector_store_id):
+    if os.path.exists(VECTOR_STORE_MANIFEST):
+        with open(VECTOR_STORE_MANIFEST) as f:
+            manifest = json.load(f)
+        # A manifest for a different vector store is of no use
+        if manifest.get("vector_store_id") == vector_store_id:
+            return manifest
+    return {"vector_store_id": vector_store_id, "files": {}}
+
+
+# The .txt files to upload: every one in the current directory for the legacy
+# format; for the compact format the state group files replace the location ones
+def knowledge_file_paths(knowledge_format=None):
+    knowledge_format = knowledge_format or KNOWLEDGE_FORMAT
+    file_paths = [f for f in os.listdir() if f.endswith(".txt")]
+    if knowledge_format == "compact":
+        file_paths = [f for f in file_paths if f not in LEGACY_LOCATION_FILES]
+        if os.path.isdir(COMPACT_DIR):
+            file_paths += [os.path.join(COMPACT_DIR, f) for f in os.listdir(COMPACT_DIR) if f.endswith(".txt")]
+    return sorted(file_paths)
+
+
+# Compact files are sized to one chunk each, so they must not be split or overlapped
+def chunking_strategy(knowledge_format=None):
+    if (knowledge_format or KNOWLEDGE_FORMAT) != "compact":
+        return {}
+    return {
+        "chunking_strategy": {
+            "type": "static",
+            "static": {"max_chunk_size_tokens": KNOWLEDGE_CHUNK_TOKENS, "chunk_overlap_tokens": 0},
+        }
+    }
 
 
+def load_to_vector_store(incremental=True):
+    if incremental:
+        return sync_vector_store()
+
+    client = get_client()
 
-def load_to_vector_store():
     # Retrieve the vector store
     vector_store = client.beta.vector_stores.retrieve(
         vector_store_id=os.getenv("VECTOR_STORE_ID")
@@ -262,8 +328,8 @@ def load_to_vector_store():
     for file in files.data:
         client.files.delete(file.id)
 
-    # Get all .txt files in the current directory
-    file_paths = [f for f in os.listdir() if f.endswith(".txt")]
+    # Get the knowledge files of the configured format
+    file_paths = knowledge_file_paths()
 
     if not file_paths:
         print("No .txt files found in the current directory.")
@@ -275,7 +341,7 @@ def load_to_vector_store():
     # Use the upload and poll SDK helper to upload the files, add them to the vector store,
     # and poll the status of the file batch for completion.
     file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-        vector_store_id=vector_store.id, files=file_streams
+        vector_store_id=vector_store.id, files=file_streams, **chunking_strategy()
     )
 
     # Print the status and the file counts of the batch
@@ -287,6 +353,85 @@ def load_to_vector_store():
         stream.close()
 
 
+# Upload only the .txt files whose content changed since the last sync.
+# New files are attached to the vector store before the files they replace are
+# detached, so the assistant never sees an empty or partial store.
+def sync_vector_store():
+    start = timeit.default_timer()
+    client = get_client()
+    vector_store_id = os.getenv("VECTOR_STORE_ID")
+    manifest = load_manifest(vector_store_id)
+    tracked = manifest["files"]
+
+    # Files currently attached to the vector store
+    attached = {file.id for file in client.beta.vector_stores.files.list(vector_store_id=vector_store_id)}
+
+    # Get the knowledge files of the configured format
+    file_paths = knowledge_file_paths()
+
+    changed = {}
+    skipped_bytes = 0
+    for path in file_paths:
+        sha256 = file_sha256(path)
+        entry = tracked.get(path)
+        if entry and entry["sha256"] == sha256 and entry["file_id"] in attached:
+            skipped_bytes += entry["bytes"]
+        else:
+            changed[path] = sha256
+
+    # Attached files that are replaced by a new version or no longer exist locally
+    keep = {tracked[path]["file_id"] for path in file_paths if path not in changed}
+    stale = attached - keep
+
+    uploaded_bytes = 0
+    new_entries = {}
+    if changed:
+        upload_start = timeit.default_timer()
+        for path, sha256 in changed.items():
+            with open(path, "rb") as stream:
+                uploaded = client.files.create(file=stream, purpose="assistants")
+            size = os.path.getsize(path)
+            uploaded_bytes += size
+            new_entries[path] = {"sha256": sha256, "file_id": uploaded.id, "bytes": size}
+
+        # Attach the new files and wait until they are indexed
+        file_batch = client.beta.vector_stores.file_batches.create_and_poll(
+            vector_store_id=vector_store_id,
+            file_ids=[entry["file_id"] for entry in new_entries.values()],
+            **chunking_strategy(),
+        )
+        print(f"Batch Status: {file_batch.status}")
+        print(f"File Counts: {file_batch.file_counts}")
+        if file_batch.status != "completed":
+            # Keep serving the current files and discard the new ones
+            print("Batch did not complete, keeping the current files attached.")
+            for entry in new_entries.values():
+                client.files.delete(entry["file_id"])
+            return
+
+        upload_time = timeit.default_timer() - upload_start
+        manifest["bytes_per_second"] = uploaded_bytes / upload_time if upload_time else None
+
+    # Detach and delete the old files now that their replacements are indexed
+    for file_id in stale:
+        client.beta.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+        client.files.delete(file_id)
+
+    manifest["files"] = {path: new_entries.get(path) or tracked[path] for path in file_paths}
+    with open(VECTOR_STORE_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    # Estimate the time saved from the measured upload and indexing throughput
+    bytes_per_second = manifest.get("bytes_per_second")
+    saved_time = f"{skipped_bytes / bytes_per_second:.1f}s" if bytes_per_second else "unknown"
+    print(
+        f"Vector store synced in {timeit.default_timer() - start:.1f}s: "
+        f"{len(changed)} of {len(file_paths)} files uploaded ({uploaded_bytes} bytes), "
+        f"{len(stale)} detached, "
+        f"{skipped_bytes} bytes skipped (about {saved_time} saved)"
+    )
+
+
 #load_to_vector_store()
 
 # assistant = client.beta.assistants.retrieve(
@@ -404,44 +549,28 @@ def load_to_vector_store():
 #         return f"Error: {error}"
     
     
-def generate_grouped_available_locations_files():
-    # Define your database connection parameters
-    db_params = {
-        "dbname": os.getenv("dbname"),
-        "user": os.getenv("user"),
-        "password": os.getenv("password"),
-        "host": os.getenv("host"),
-        "port": os.getenv("pg_port"),
-    }
-
+# Write one group of the by-state or by-city file, e.g. "Available locations in Jalisco state"
+def write_locations_group(file, title, locations):
+    file.write(f"{title}:\n\n")
+    for location in locations:
+        file.write(f"id: {location.id},\n")
+        file.write(f"name: {location.name},\n")
+        file.write(f"Address: {location.address}\n")
+        file.write(f"city: {location.city},\n")
+        file.write(f"state: {location.state},\n")
+        file.write(f"zip: {location.zip},\n")
+        file.write("\n")  # Separator between locations
+    file.write("\n")  # Separator between groups
+
+
+def generate_grouped_available_locations_files(snapshot=None):
     try:
-        # Connect to your PostgreSQL database
-        connection = psycopg2.connect(**db_params)
-        cursor = connection.cursor()
-
-        # Define the query to select all active locations with available positions
-        query = sql.SQL("""
-            SELECT DISTINCT l.id, l.name, l.address, l.city, l.state, l.zip
-            FROM locations l
-            JOIN locations_positions lp ON l.id = lp.location_id
-            JOIN positions p ON lp.position_id = p.id
-            WHERE l.is_active = TRUE
-              AND p.is_active = TRUE
-              AND lp.filled_openings < lp.max_openings
-        """)
-
-        # Execute the query
-        cursor.execute(query)
-
-        # Fetch all results
-        locations = cursor.fetchall()
+        # Read the data from the database unless a snapshot was given
+        if snapshot is None:
+            snapshot = read_export_snapshot_standalone()
 
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-
-        # Close the cursor and connection
-        cursor.close()
-        connection.close()
+        # All active locations with available positions
+        locations = locations_with_available_positions(snapshot)
 
         if locations:
             # Group locations by state and city
@@ -449,49 +578,26 @@ def generate_grouped_available_locations_files():
             city_groups = {}
 
             for location in locations:
-                location_dict = dict(zip(colnames, location))
-                state = location_dict['state']
-                city = location_dict['city']
-
                 # Add to state group
-                if state not in state_groups:
-                    state_groups[state] = []
-                state_groups[state].append(location_dict)
+                if location.state not in state_groups:
+                    state_groups[location.state] = []
+                state_groups[location.state].append(location)
 
                 # Add to city group
-                if city not in city_groups:
-                    city_groups[city] = []
-                city_groups[city].append(location_dict)
+                if location.city not in city_groups:
+                    city_groups[location.city] = []
+                city_groups[location.city].append(location)
 
             # Write all available locations grouped by state to a file
-            with open("all_available_locations_by_state.txt", "w") as state_file:
+            with open("all_available_locations_by_state.txt", "w", encoding="utf-8") as state_file:
                 for state, locations_in_state in state_groups.items():
-                    state_file.write(f"Available locations in {state} state:\n\n")
-                    for location in locations_in_state:
-                        state_file.write(f"id: {location['id']},\n")
-                        state_file.write(f"name: {location['name']},\n")
-                        state_file.write(f"Address: {location['address']}\n")
-                        state_file.write(f"city: {location['city']},\n")
-                        state_file.write(f"state: {location['state']},\n")
-                        state_file.write(f"zip: {location['zip']},\n")                        
-                        state_file.write("\n")  # Separator between locations
-                    state_file.write("\n")  # Separator between states
+                    write_locations_group(state_file, f"Available locations in {state} state", locations_in_state)
             print("File 'all_available_locations_by_state.txt' generated successfully.")
 
             # Write all available locations grouped by city to a file
-            with open("all_available_locations_by_city.txt", "w") as city_file:
+            with open("all_available_locations_by_city.txt", "w", encoding="utf-8") as city_file:
                 for city, locations_in_city in city_groups.items():
-                    city_file.write(f"Available locations in {city} city:\n\n")
-                    for location in locations_in_city:
-                        city_file.write(f"id: {location['id']},\n")
-                        city_file.write(f"name: {location['name']},\n")
-                        city_file.write(f"Address: {location['address']}\n")
-                        city_file.write(f"city: {location['city']},\n")
-                        city_file.write(f"state: {location['state']},\n")
-                        city_file.write(f"zip: {location['zip']},\n")                        
-
-                        city_file.write("\n")  # Separator between locations
-                    city_file.write("\n")  # Separator between cities
+                    write_locations_group(city_file, f"Available locations in {city} city", locations_in_city)
             print("File 'all_available_locations_by_city.txt' generated successfully.")
 
             return "Files generated successfully."
@@ -506,73 +612,31 @@ def generate_grouped_available_locations_files():
 
 
 
-def generate_positions_available_for_locations():
-    # Define your database connection parameters
-    db_params = {
-        "dbname": os.getenv("dbname"),
-        "user": os.getenv("user"),
-        "password": os.getenv("password"),
-        "host": os.getenv("host"),
-        "port": os.getenv("pg_port"),
-    }
+# Write the available positions of one location to positions_available_for_locations.txt,
+# with their names from positions (position id -> catalog.Position)
+def write_location_positions(file, location, positions):
+    file.write(f"Positions available for {location.name} (Location id: {location.id}):\n\n")
+    for position_id in location.position_ids:
+        file.write(f"id: {position_id},\n")
+        file.write(f"name: {positions[position_id].name}.\n")
+        file.write("\n")  # Separator between positions
+    file.write("\n")  # Separator between locations
 
+
+def generate_positions_available_for_locations(snapshot=None):
     try:
-        # Connect to your PostgreSQL database
-        connection = psycopg2.connect(**db_params)
-        cursor = connection.cursor()
-
-        # Define the query to select all active locations with their available positions
-        query = sql.SQL("""
-            SELECT l.id AS location_id, l.name AS location_name, p.id AS position_id, p.name AS position_name
-            FROM locations l
-            JOIN locations_positions lp ON l.id = lp.location_id
-            JOIN positions p ON lp.position_id = p.id
-            WHERE l.is_active = TRUE
-              AND p.is_active = TRUE
-              AND lp.filled_openings < lp.max_openings
-            ORDER BY l.id, p.id
-        """)
-
-        # Execute the query
-        cursor.execute(query)
+        # Read the data from the database unless a snapshot was given
+        if snapshot is None:
+            snapshot = read_export_snapshot_standalone()
 
-        # Fetch all results
-        results = cursor.fetchall()
-
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-
-        # Close the cursor and connection
-        cursor.close()
-        connection.close()
-
-        if results:
-            # Group positions by location
-            location_groups = {}
-            for row in results:
-                row_dict = dict(zip(colnames, row))
-                location_id = row_dict['location_id']
-                location_name = row_dict['location_name']
-
-                if location_id not in location_groups:
-                    location_groups[location_id] = {
-                        "location_name": location_name,
-                        "positions": []
-                    }
-                location_groups[location_id]["positions"].append({
-                    "id": row_dict['position_id'],
-                    "name": row_dict['position_name']
-                })
+        # All active locations with their available positions, ordered by location and position
+        locations = locations_with_available_positions(snapshot)
 
+        if locations:
             # Write positions available for each location to a file
-            with open("positions_available_for_locations.txt", "w") as file:
-                for location_id, data in location_groups.items():
-                    file.write(f"Positions available for {data['location_name']} (Location id: {location_id}):\n\n")
-                    for position in data["positions"]:
-                        file.write(f"id: {position['id']},\n")
-                        file.write(f"name: {position['name']}.\n")
-                        file.write("\n")  # Separator between positions
-                    file.write("\n")  # Separator between locations
+            with open("positions_available_for_locations.txt", "w", encoding="utf-8") as file:
+                for location in locations:
+                    write_location_positions(file, location, snapshot.positions)
             print("File 'positions_available_for_locations.txt' generated successfully.")
             return "File generated successfully."
 
@@ -588,110 +652,72 @@ def generate_positions_available_for_locations():
     
 
 
-import os
-import psycopg2
-from psycopg2 import sql
-
-def all_available_positions_details(filename="all_available_positions_details.txt"):
-    # Define los parámetros de conexión a la base de datos
-    db_params = {
-        "dbname": os.getenv("dbname"),
-        "user": os.getenv("user"),
-        "password": os.getenv("password"),
-        "host": os.getenv("host"),
-        "port": os.getenv("pg_port"),
-    }
-
+# Escribe los detalles de una posición
+def write_position_details(file, position):
+    file.write(f"Position ID: {position.position_id}\n")
+    file.write(f"Name: {position.name}\n")
+    file.write(f"Description: {position.description}\n")
+
+    # Formatear key_responsibilities si es una lista y no es None
+    key_responsibilities = position.key_responsibilities
+    if key_responsibilities is not None:
+        if isinstance(key_responsibilities, list):
+            key_responsibilities = "; ".join(key_responsibilities)
+        file.write(f"Key Responsibilities: {key_responsibilities}\n")
+
+    # Formatear qualifications si es una lista y no es None
+    qualifications = position.qualifications
+    if qualifications is not None:
+        if isinstance(qualifications, list):
+            qualifications = "; ".join(qualifications)
+        file.write(f"Qualifications: {qualifications}\n")
+
+    # Formatear los beneficios si son una lista y no es None
+    benefits = position.benefits
+    if benefits is not None:
+        if isinstance(benefits, list):
+            benefits = "; ".join(benefits)
+        file.write(f"Benefits: {benefits}\n")
+
+    # Formatear la información del salario si no es None
+    salary_range = position.salary_range
+    salary_currency = position.salary_currency
+    salary_period = position.salary_period
+
+    if salary_range is not None:
+        salary_info = f"{salary_range}"
+        if salary_currency:
+            salary_info += f" {salary_currency}"
+        if salary_period:
+            salary_info += f" per {salary_period}"
+        file.write(f"Salary Range: {salary_info}\n")
+
+    # Escribir job_type si no es None
+    job_type = position.job_type
+    if job_type is not None:
+        file.write(f"Job Type: {job_type}\n")
+
+    # Escribir location_type si no es None
+    location_type = position.location_type
+    if location_type is not None:
+        file.write(f"Location Type: {location_type}\n")
+
+    file.write("\n")  # Separador entre posiciones
+
+
+def all_available_positions_details(filename="all_available_positions_details.txt", snapshot=None):
     try:
-        # Conéctate a la base de datos PostgreSQL
-        connection = psycopg2.connect(**db_params)
-        cursor = connection.cursor()
-
-        # Define la consulta SQL
-        query = sql.SQL("""
-            SELECT DISTINCT
-                lp.position_id, 
-                p.name, 
-                p.description, 
-                p.key_responsibilities, 
-                p.qualifications, 
-                p.benefits, 
-                p.salary_range,
-                p.salary_currency, 
-                p.salary_period, 
-                p.job_type, 
-                p.location_type
-            FROM positions p
-            JOIN locations_positions lp ON p.id = lp.position_id
-            WHERE p.is_active = TRUE
-              AND lp.filled_openings < lp.max_openings
-        """)
-
-        # Ejecuta la consulta
-        cursor.execute(query)
-        positions = cursor.fetchall()
-        colnames = [desc[0] for desc in cursor.description]
+        # Lee los datos de la base de datos si no se recibió un snapshot
+        if snapshot is None:
+            snapshot = read_export_snapshot_standalone()
 
-        # Cierra la conexión a la base de datos
-        cursor.close()
-        connection.close()
+        positions = list(snapshot.positions.values())
 
         if positions:
-            # Convierte los resultados en una lista de diccionarios
-            positions_list = [dict(zip(colnames, position)) for position in positions]
-
             # Escribe los detalles en un archivo de texto
             with open(filename, "w", encoding="utf-8") as file:
-                for position in positions_list:
-                    file.write(f"Position ID: {position['position_id']}\n")
-                    file.write(f"Name: {position['name']}\n")
-                    file.write(f"Description: {position['description']}\n")
-                    
-                    # Formatear key_responsibilities si es una lista y no es None
-                    key_responsibilities = position.get('key_responsibilities')
-                    if key_responsibilities is not None:
-                        if isinstance(key_responsibilities, list):
-                            key_responsibilities = "; ".join(key_responsibilities)
-                        file.write(f"Key Responsibilities: {key_responsibilities}\n")
-
-                    # Formatear qualifications si es una lista y no es None
-                    qualifications = position.get('qualifications')
-                    if qualifications is not None:
-                        if isinstance(qualifications, list):
-                            qualifications = "; ".join(qualifications)
-                        file.write(f"Qualifications: {qualifications}\n")
-
-                    # Formatear los beneficios si son una lista y no es None
-                    benefits = position.get('benefits')
-                    if benefits is not None:
-                        if isinstance(benefits, list):
-                            benefits = "; ".join(benefits)
-                        file.write(f"Benefits: {benefits}\n")
-
-                    # Formatear la información del salario si no es None
-                    salary_range = position.get('salary_range')
-                    salary_currency = position.get('salary_currency')
-                    salary_period = position.get('salary_period')
-
-                    if salary_range is not None:
-                        salary_info = f"{salary_range}"
-                        if salary_currency:
-                            salary_info += f" {salary_currency}"
-                        if salary_period:
-                            salary_info += f" per {salary_period}"
-                        file.write(f"Salary Range: {salary_info}\n")
-
-                    # Escribir job_type si no es None
-                    job_type = position.get('job_type')
-                    if job_type is not None:
-                        file.write(f"Job Type: {job_type}\n")
-
-                    # Escribir location_type si no es None
-                    location_type = position.get('location_type')
-                    if location_type is not None:
-                        file.write(f"Location Type: {location_type}\n")
-
-                    file.write("\n")  # Separador entre posiciones
+                for position in positions:
+                    write_position_details(file, position)
             
             print(f"File '{filename}' generated succesfully.")
         else:
@@ -701,9 +727,484 @@ def all_available_positions_details(filename="all_available_positions_details.tx
         print(f"Error: {error}")
 
 
-# Llamar a la función
-all_available_positions_details()
-generate_positions_available_for_locations()
-generate_grouped_available_locations_files()
-load_to_vector_store()
-    
+_token_encoding = None
+
+
+# Tokens of a text with the o200k_base encoding when tiktoken can load it,
+# otherwise four-character pieces (about one token each)
+def tokenize(text):
+    global _token_encoding
+    if _token_encoding is None:
+        try:
+            import tiktoken
+            _token_encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as error:
+            print(f"tiktoken not available ({type(error).__name__}), estimating 4 characters per token")
+            _token_encoding = False
+    if _token_encoding:
+        return _token_encoding.encode(text)
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+def count_tokens(text):
+    return len(tokenize(text))
+
+
+# ASCII, lowercase, underscores: "Nuevo León" -> "nuevo_leon"
+def slugify(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return "_".join("".join(c if c.isalnum() else " " for c in text.lower()).split())
+
+
+# One store per line; the zip is only added when the address does not have it already
+def compact_location_line(location):
+    address = location.address or ""
+    if location.zip and str(location.zip) not in address:
+        address = f"{address}, zip {location.zip}" if address else f"zip {location.zip}"
+    return f"{location.id} | {location.name} | {address} | {', '.join(str(p) for p in location.position_ids)}"
+
+
+def _compact_file_text(state, part, parts, sections, positions):
+    used = sorted({position_id for _, lines in sections for _, ids in lines for position_id in ids})
+    title = f"Available locations in {state} state"
+    if parts > 1:
+        title += f" (part {part} of {parts})"
+    text = [
+        title,
+        "Positions: " + "; ".join(f"{p} {positions[p].name}" for p in used),
+        "Stores as id | name | address | position ids",
+    ]
+    for city, lines in sections:
+        text.append("")
+        text.append(f"{city}:")
+        text.extend(line for line, _ in lines)
+    return "\n".join(text) + "\n"
+
+
+# The compact knowledge files as {filename: text}: one file per state (of `states`, or all), with its
+# cities and stores, and the positions legend of the stores in it. Every store is
+# written once. A state that does not fit in chunk_tokens is cut into parts at city
+# boundaries (or between stores for a city larger than a chunk), each with its own
+# header, so one retrieved chunk always holds complete groups.
+def compact_location_files(snapshot, chunk_tokens=KNOWLEDGE_CHUNK_TOKENS, states=None):
+    positions = snapshot.positions
+    # Leave room for differences between the tokenizer here and the one of file_search
+    budget = int(chunk_tokens * 0.9)
+
+    # Stores by state and city
+    groups = {}
+    for location in locations_with_available_positions(snapshot):
+        if states is None or location.state in states:
+            groups.setdefault(location.state, {}).setdefault(location.city, []).append(location)
+
+    files = {}
+    for state, cities in groups.items():
+        # City sections as (city, [(line, position ids)]); a city too large for a
+        # chunk on its own is cut between stores, the pieces keep the city header
+        sections = []
+        for city, stores in cities.items():
+            current = []
+            for location in stores:
+                line = (compact_location_line(location), location.position_ids)
+                if current and count_tokens(_compact_file_text(state, 2, 2, [(city, current + [line])], positions)) > budget:
+                    sections.append((city, current))
+                    current = []
+                current.append(line)
+            sections.append((city, current))
+
+        # Pack whole sections into as few chunk-sized parts as possible
+        parts = [[]]
+        for section in sections:
+            if parts[-1] and count_tokens(_compact_file_text(state, 2, 2, parts[-1] + [section], positions)) > budget:
+                parts.append([])
+            parts[-1].append(section)
+
+        for part, part_sections in enumerate(parts, start=1):
+            suffix = f"_{part}" if len(parts) > 1 else ""
+            filename = f"locations_{slugify(state)}{suffix}.txt"
+            files[filename] = _compact_file_text(state, part, len(parts), part_sections, positions)
+    return files
+
+
+# Write the compact knowledge files to COMPACT_DIR, replacing the previous ones
+def generate_compact_location_files(snapshot=None, directory=COMPACT_DIR, chunk_tokens=KNOWLEDGE_CHUNK_TOKENS):
+    try:
+        if snapshot is None:
+            snapshot = read_export_snapshot_standalone()
+
+        files = compact_location_files(snapshot, chunk_tokens)
+        if not files:
+            print("No active locations with available positions found.")
+            return {}
+
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        for filename, text in files.items():
+            with open(os.path.join(directory, filename), "w", encoding="utf-8") as file:
+                file.write(text)
+        print(f"{len(files)} compact location files generated in '{directory}'.")
+        return files
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error: {error}")
+        return {}
+
+
+# Rewrite the compact files of some states only, from a snapshot that has (at least)
+# all the locations of those states. Returns the paths written and deleted.
+def write_compact_state_files(snapshot, states, directory=COMPACT_DIR, chunk_tokens=KNOWLEDGE_CHUNK_TOKENS):
+    states = set(states)
+    files = compact_location_files(snapshot, chunk_tokens, states)
+
+    # The previous parts of those states, a state may now have more or fewer parts or none
+    os.makedirs(directory, exist_ok=True)
+    patterns = [re.compile(rf"locations_{re.escape(slugify(state))}(_\d+)?\.txt") for state in states]
+    deleted = []
+    for filename in os.listdir(directory):
+        if filename not in files and any(pattern.fullmatch(filename) for pattern in patterns):
+            os.remove(os.path.join(directory, filename))
+            deleted.append(os.path.join(directory, filename))
+
+    written = []
+    for filename, text in files.items():
+        path = os.path.join(directory, filename)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        written.append(path)
+    return written, deleted
+
+
+# Chunks of a token list as file_search's default static strategy cuts them
+def _chunk_spans(token_count, chunk_tokens, overlap_tokens):
+    step = chunk_tokens - overlap_tokens
+    starts = range(0, max(token_count - overlap_tokens, 1), step)
+    return [(start, min(start + chunk_tokens, token_count)) for start in starts]
+
+
+# Tokens of the fewest chunks that together hold the text spans (start, end)
+def _covering_chunk_tokens(spans, chunks):
+    used = set()
+    for start, end in spans:
+        position = start
+        while position < end:
+            # The chunk reaching furthest among those that contain position
+            index = max(
+                (i for i, (chunk_start, chunk_end) in enumerate(chunks) if chunk_start <= position < chunk_end),
+                key=lambda i: chunks[i][1],
+            )
+            used.add(index)
+            position = chunks[index][1]
+    return sum(chunks[i][1] - chunks[i][0] for i in used)
+
+
+# Token spans of the blocks of a legacy file, keyed by their header line
+def _legacy_blocks(text, marker):
+    blocks = {}
+    offsets = [i for i in range(len(text)) if text.startswith(marker, i)]
+    for start, end in zip(offsets, offsets[1:] + [len(text)]):
+        header = text[start:text.index("\n", start)]
+        blocks[header] = (count_tokens(text[:start]), count_tokens(text[:end]))
+    return blocks
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values)),
+        "p95": values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))],
+        "max": values[-1],
+    }
+
+
+# Measurement mode: tokens of the file_search chunks needed to answer "which stores
+# are in city X" or "in state Y", including the positions of those stores, for the
+# legacy files (default chunking: 800 tokens, 400 overlap) and the compact ones
+# (one chunk per file). This is the minimum a complete answer retrieves; file_search
+# may return more chunks than that. The positions details file is the same in both.
+def measure_retrieved_tokens(snapshot=None, chunk_tokens=KNOWLEDGE_CHUNK_TOKENS):
+    if snapshot is None:
+        snapshot = read_export_snapshot_standalone()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        generate_grouped_available_locations_files(snapshot=snapshot)
+        generate_positions_available_for_locations(snapshot=snapshot)
+        legacy = {}
+        for filename in LEGACY_LOCATION_FILES:
+            with open(filename, encoding="utf-8") as file:
+                legacy[filename] = file.read()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    compact = compact_location_files(snapshot, chunk_tokens)
+
+    legacy_chunks = {
+        filename: _chunk_spans(count_tokens(text), 800, 400) for filename, text in legacy.items()
+    }
+    position_blocks = _legacy_blocks(legacy["positions_available_for_locations.txt"], "Positions available for ")
+    groups = {
+        "city": _legacy_blocks(legacy["all_available_locations_by_city.txt"], "Available locations in "),
+        "state": _legacy_blocks(legacy["all_available_locations_by_state.txt"], "Available locations in "),
+    }
+
+    stores = locations_with_available_positions(snapshot)
+    report = {
+        "tokenizer": "o200k_base" if _token_encoding else "estimate",
+        "legacy_total_tokens": sum(count_tokens(text) for text in legacy.values()),
+        "compact_total_tokens": sum(count_tokens(text) for text in compact.values()),
+        "compact_files": len(compact),
+        "compact_max_file_tokens": max((count_tokens(text) for text in compact.values()), default=0),
+    }
+    for kind, blocks in groups.items():
+        legacy_tokens = []
+        compact_tokens = []
+        filename = f"all_available_locations_by_{kind}.txt"
+        for name in {getattr(store, kind) for store in stores}:
+            members = [store for store in stores if getattr(store, kind) == name]
+            spans = [blocks[f"Available locations in {name} {kind}:"]]
+            legacy_total = _covering_chunk_tokens(spans, legacy_chunks[filename])
+            spans = [
+                position_blocks[f"Positions available for {store.name} (Location id: {store.id}):"]
+                for store in members
+            ]
+            legacy_total += _covering_chunk_tokens(spans, legacy_chunks["positions_available_for_locations.txt"])
+            legacy_tokens.append(legacy_total)
+
+            ids = {f"\n{store.id} | " for store in members}
+            compact_tokens.append(sum(
+                count_tokens(text) for text in compact.values() if any(i in text for i in ids)
+            ))
+        report[f"legacy_{kind}_lookup"] = _summary(legacy_tokens)
+        report[f"compact_{kind}_lookup"] = _summary(compact_tokens)
+
+    print(json.dumps(report, indent=4))
+    return report
+
+
+# Streaming export: each file is read through its own named (server-side) cursor,
+# EXPORT_ITERSIZE rows per round-trip, ordered so that its groups (a state, a city,
+# a location) arrive one after the other and are written as soon as they end.
+# Memory grows with the largest group and the position names, not with the catalog.
+# All the cursors run in one REPEATABLE READ transaction, so the files are as
+# consistent with each other as with read_export_snapshot.
+
+# A location with at least one available position
+_AVAILABLE_LOCATION = """
+    l.is_active = TRUE
+    AND EXISTS (
+        SELECT 1
+        FROM locations_positions lp
+        JOIN positions p ON lp.position_id = p.id
+        WHERE lp.location_id = l.id
+          AND p.is_active = TRUE
+          AND lp.filled_openings < lp.max_openings
+    )
+"""
+
+# Locations with available positions, grouped by a column. The groups come in the order
+# of their lowest location id, the same order the snapshot-based writers use.
+_STREAM_LOCATIONS_BY = """
+    SELECT l.id, l.name, l.address, l.city, l.state, l.zip
+    FROM locations l
+    WHERE {available}
+    ORDER BY MIN(l.id) OVER (PARTITION BY l.{column}), l.id
+"""
+
+# One row per location and available position, grouped by state (for the compact
+# files) or by location only (for positions_available_for_locations.txt)
+_STREAM_LOCATION_POSITIONS = """
+    SELECT l.id, l.name, l.address, l.city, l.state, l.zip, l.phone,
+           lp.position_id, lp.max_openings, lp.filled_openings
+    FROM locations l
+    JOIN locations_positions lp ON lp.location_id = l.id
+    JOIN positions p ON lp.position_id = p.id
+    WHERE l.is_active = TRUE
+      AND p.is_active = TRUE
+      AND lp.filled_openings < lp.max_openings
+    ORDER BY {order}l.id, lp.position_id
+"""
+
+_STREAM_POSITIONS = """
+    SELECT DISTINCT
+        lp.position_id,
+        p.name,
+        p.description,
+        p.key_responsibilities,
+        p.qualifications,
+        p.benefits,
+        p.salary_range,
+        p.salary_currency,
+        p.salary_period,
+        p.job_type,
+        p.location_type
+    FROM positions p
+    JOIN locations_positions lp ON p.id = lp.position_id
+    WHERE p.is_active = TRUE
+      AND lp.filled_openings < lp.max_openings
+    ORDER BY lp.position_id
+"""
+
+
+# Rows of a query read through a named cursor, itersize rows at a time
+def stream_rows(connection, name, query, itersize=EXPORT_ITERSIZE):
+    with connection.cursor(name=name) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query)
+        yield from cursor
+
+
+# Consecutive rows of _STREAM_LOCATION_POSITIONS with the same key, as one catalog per group
+def _stream_catalogs(rows, positions, key):
+    for _, group in itertools.groupby(rows, key=key):
+        catalog = Catalog(positions)
+        for location_id, name, address, city, state, zip_code, phone, position_id, max_openings, \
+                filled_openings in group:
+            catalog.add_location(location_id, name, address, city, state, zip_code, phone)
+            catalog.add_opening(location_id, position_id, max_openings, filled_openings)
+        yield catalog
+
+
+def _stream_grouped_locations(connection, column, filename, title, itersize):
+    query = _STREAM_LOCATIONS_BY.format(available=_AVAILABLE_LOCATION, column=column)
+    groups = 0
+    with open(filename, "w", encoding="utf-8") as file:
+        locations = (Location(*row) for row in stream_rows(connection, f"export_by_{column}", query, itersize))
+        for value, group in itertools.groupby(locations, key=lambda location: getattr(location, column)):
+            write_locations_group(file, title.format(value), group)
+            groups += 1
+    print(f"File '{filename}' generated successfully ({groups} groups streamed).")
+
+
+def _stream_location_positions(connection, positions, itersize):
+    query = _STREAM_LOCATION_POSITIONS.format(order="")
+    groups = 0
+    with open("positions_available_for_locations.txt", "w", encoding="utf-8") as file:
+        rows = stream_rows(connection, "export_location_positions", query, itersize)
+        for group in _stream_catalogs(rows, positions, key=lambda row: row[0]):
+            for location in group.locations.values():
+                write_location_positions(file, location, positions)
+            groups += 1
+    print(f"File 'positions_available_for_locations.txt' generated successfully ({groups} groups streamed).")
+
+
+def _stream_compact_files(connection, positions, directory, chunk_tokens, itersize):
+    query = _STREAM_LOCATION_POSITIONS.format(order="MIN(l.id) OVER (PARTITION BY l.state), ")
+    written = set()
+    rows = stream_rows(connection, "export_compact", query, itersize)
+    for group in _stream_catalogs(rows, positions, key=lambda row: row[4]):
+        state = next(iter(group.locations.values())).state
+        paths, _ = write_compact_state_files(group, {state}, directory, chunk_tokens)
+        written.update(paths)
+
+    # Files of states that have no available locations anymore
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if path not in written:
+            os.remove(path)
+    print(f"{len(written)} compact location files generated in '{directory}' (streamed).")
+
+
+# Generate every knowledge file of the configured format without holding the catalog in memory
+def export_knowledge_files_streaming(itersize=EXPORT_ITERSIZE, knowledge_format=None):
+    start = timeit.default_timer()
+    knowledge_format = knowledge_format or KNOWLEDGE_FORMAT
+
+    with pooled_connection() as connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+            # The position details are written as they come, the other files only need the names
+            positions = {}
+            with open("all_available_positions_details.txt", "w", encoding="utf-8") as file:
+                for row in stream_rows(connection, "export_positions", _STREAM_POSITIONS, itersize):
+                    position = Position(*row)
+                    write_position_details(file, position)
+                    positions[position.position_id] = Position(position.position_id, position.name)
+            print(f"File 'all_available_positions_details.txt' generated successfully ({len(positions)} positions).")
+
+            if knowledge_format == "compact":
+                _stream_compact_files(connection, positions, COMPACT_DIR, KNOWLEDGE_CHUNK_TOKENS, itersize)
+            else:
+                _stream_location_positions(connection, positions, itersize)
+                _stream_grouped_locations(
+                    connection, "state", "all_available_locations_by_state.txt", "Available locations in {} state",
+                    itersize,
+                )
+                _stream_grouped_locations(
+                    connection, "city", "all_available_locations_by_city.txt", "Available locations in {} city",
+                    itersize,
+                )
+            connection.commit()
+        except psycopg2.Error:
+            connection.rollback()
+            raise
+
+    print(f"Knowledge files exported (streaming) in {timeit.default_timer() - start:.3f}s")
+    print_pool_stats()
+
+
+# Generate every knowledge file of the configured format from a single snapshot of the database
+def export_knowledge_files():
+    start = timeit.default_timer()
+    snapshot = read_export_snapshot_standalone()
+
+    all_available_positions_details(snapshot=snapshot)
+    if KNOWLEDGE_FORMAT == "compact":
+        generate_compact_location_files(snapshot=snapshot)
+    else:
+        generate_positions_available_for_locations(snapshot=snapshot)
+        generate_grouped_available_locations_files(snapshot=snapshot)
+
+    print(f"Knowledge files exported in {timeit.default_timer() - start:.3f}s")
+    print_pool_stats()
+    return snapshot
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the knowledge files and sync the vector store.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="export through server-side cursors without reading the whole catalog first (EXPORT_STREAMING)",
+    )
+    parser.add_argument(
+        "--measure",
+        action="store_true",
+        help="only report the retrieved-chunk tokens of the legacy and compact formats",
+    )
+    args = parser.parse_args()
+    if args.measure:
+        measure_retrieved_tokens()
+        raise SystemExit
+
+    if args.stream or EXPORT_STREAMING:
+        # There is no snapshot to build the JSON structures of get_all_locations from,
+        # they are only needed for the JSON files below
+        export_knowledge_files_streaming()
+        snapshot = None
+    else:
+        snapshot = export_knowledge_files()
+
+        # Fetch all locations and their positions from the same snapshot
+        available_locations_and_positions, locations_and_positions_details = (
+            get_all_locations(snapshot=snapshot)
+        )
+
+    # Save the results to JSON files
+    #save_to_json(available_locations_and_positions, "all_available_locations_and_positions.json")
+    #save_to_json(
+    #    locations_and_positions_details, "locations_and_positions_details.json"
+    #)
+
+    generate_nearest_locations_by_zip(snapshot)
+    generate_place_index(snapshot)
+    load_to_vector_store()
@@ -0,0 +1,35 @@
+import pytest
+from openai import OpenAI
+
+from chat_turn import run_turn
+from mock_assistants import MockConfig, start_mock_server
+
+
+@pytest.fixture(scope="module")
+def mock_server():
+    mock, base_url = start_mock_server(MockConfig(queue_latency=0.05, run_latency=0.1, request_latency=0.0,
+                                                  stream_chunk_delay=0.0, poll_after_ms=10))
+    return mock, OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+
+
+# A run left active by an interrupted turn makes the next turn's run request fail.
+# The retry cancels it and must still send the new message.
+@pytest.mark.parametrize("stream", [True, False])
+def test_retry_after_active_run_sends_the_message(mock_server, stream):
+    mock, client = mock_server
+    thread_id = client.beta.threads.create().id
+    mock.config.stall_rate = 1.0
+    client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id="asst_mock",
+        additional_messages=[{"role": "user", "content": "first"}],
+    )
+    mock.config.stall_rate = 0.0
+
+    result = run_turn(client, "asst_mock", thread_id, "second message", None, stream=stream, retries=1, deadline=10)
+
+    assert result["status"] == "completed"
+    assert result["response"] == "Recibido: second message"
+    user_messages = [m["content"][0]["text"]["value"] for m in mock.threads[thread_id]["messages"]
+                     if m["role"] == "user"]
+    assert user_messages == ["first", "second message"]
@@ -0,0 +1,147 @@
+import importlib.util
+import os
+
+import pytest
+
+from catalog import POSITION_FIELDS
+
+
+def _load_exporter():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test.py")
+    spec = importlib.util.spec_from_file_location("exporter", path)
+    exporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(exporter)
+    return exporter
+
+
+exporter = _load_exporter()
+
+
+# In-memory catalog tables answering the queries of read_export_snapshot and
+# catalog.load_catalog_changes, as Postgres would
+class FakeDatabase:
+    def __init__(self):
+        self.locations = {
+            1: {"name": "Centro", "address": "Madero 1", "city": "Ciudad de México", "state": "CDMX",
+                "zip": "06000", "phone": "5550000001", "is_active": True},
+            2: {"name": "Norte", "address": "Hidalgo 2", "city": "Monterrey", "state": "Nuevo León",
+                "zip": "64000", "phone": "8180000002", "is_active": True},
+            3: {"name": "Sur", "address": "Juárez 3", "city": "Puebla", "state": "Puebla",
+                "zip": "72000", "phone": "2220000003", "is_active": True},
+        }
+        self.positions = {
+            10: {"name": "Cajero", "is_active": True},
+            11: {"name": "Gerente", "is_active": True},
+        }
+        # (location_id, position_id): [max_openings, filled_openings]
+        self.openings = {(1, 10): [3, 1], (1, 11): [1, 0], (2, 10): [2, 0], (3, 11): [1, 0]}
+
+    def connection(self):
+        return FakeConnection(self)
+
+    def _available(self, location_id, position_id):
+        max_openings, filled_openings = self.openings[location_id, position_id]
+        return self.positions[position_id]["is_active"] and filled_openings < max_openings
+
+    def select(self, query, params):
+        if "SELECT DISTINCT location_id FROM locations_positions" in query:
+            return sorted({(location_id,) for location_id, position_id in self.openings if position_id in params[0]})
+        if "FROM locations l" in query:
+            rows = []
+            for location_id, location in sorted(self.locations.items()):
+                if not location["is_active"]:
+                    continue
+                if "l.state = ANY" in query and location["state"] not in params["states"]:
+                    continue
+                if "l.id = ANY" in query and location_id not in params["location_ids"]:
+                    continue
+                details = (location_id, location["name"], location["address"], location["city"],
+                           location["state"], location["zip"], location["phone"])
+                links = [
+                    (position_id, *self.openings[location_id, position_id])
+                    for linked_id, position_id in sorted(self.openings)
+                    if linked_id == location_id and self._available(location_id, position_id)
+                ]
+                rows.extend(details + link for link in links or [(None, None, None)])
+            return rows
+        if "FROM positions p" in query:
+            available = sorted({position_id for location_id, position_id in self.openings
+                                if self._available(location_id, position_id)})
+            return [
+                (position_id, self.positions[position_id]["name"]) + (None,) * (len(POSITION_FIELDS) - 2)
+                for position_id in available
+            ]
+        raise AssertionError(f"Unexpected query: {query}")
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        self.rows = self.database.select(query, params)
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def _snapshot_rows(snapshot):
+    locations = [
+        (location.id, location.name, location.address, location.city, location.state, location.zip,
+         location.phone, location.position_ids, location.openings)
+        for location in snapshot.locations.values()
+    ]
+    positions = [position.as_dict() for position in snapshot.positions.values()]
+    return locations, positions
+
+
+@pytest.mark.parametrize("change", ["openings_filled", "location_deactivated", "position_deactivated", "phone"])
+def test_updated_snapshot_matches_a_full_read(change):
+    database = FakeDatabase()
+    snapshot = exporter.read_export_snapshot(database.connection())
+
+    location_ids, position_ids = set(), set()
+    if change == "openings_filled":
+        # Location 3 is left without positions but is still exported
+        database.openings[3, 11] = [1, 1]
+        location_ids.add(3)
+    elif change == "location_deactivated":
+        database.locations[2]["is_active"] = False
+        location_ids.add(2)
+    elif change == "position_deactivated":
+        database.positions[11]["is_active"] = False
+        position_ids.add(11)
+    else:
+        database.locations[1]["phone"] = "5559999999"
+        location_ids.add(1)
+
+    updated = exporter.update_export_snapshot(snapshot, location_ids, position_ids, database.connection())
+    full = exporter.read_export_snapshot(database.connection())
+
+    assert _snapshot_rows(updated) == _snapshot_rows(full)
+    assert updated.snapshot_hash == full.snapshot_hash
+    assert exporter.get_all_locations(snapshot=updated) == exporter.get_all_locations(snapshot=full)
@@ -0,0 +1,210 @@
+import atexit
+import json
+import os
+import threading
+import time
+import timeit
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Per-stage latency spans of the chat turns.
+# Every span is kept in memory for the p50/p95/p99 summaries served in Prometheus
+# text format, and appended to a local rolling JSON-lines file by a background
+# thread every METRICS_FLUSH_SECONDS, so recording a span never waits on the disk.
+
+METRICS_FILE = os.getenv("METRICS_FILE", "turn_metrics.jsonl")
+# Size in bytes at which the metrics file is rotated to METRICS_FILE + ".1"
+METRICS_FILE_MAX_BYTES = int(os.getenv("METRICS_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+# Number of recent spans per stage used for the summaries
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+# Seconds between writes of the recorded spans to METRICS_FILE
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+# Port of the Prometheus endpoint, empty or 0 to disable it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108") or 0)
+# Address the endpoint listens on, 0.0.0.0 to reach it from other hosts
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_durations = {}
+_totals = {}
+_counters = {}
+# JSON lines of the spans not written to METRICS_FILE yet
+_pending = []
+_writer = None
+# One flush at a time, they rotate the file
+_flush_lock = threading.Lock()
+
+
+def _write_lines(lines):
+    text = "".join(lines)
+    if os.path.exists(METRICS_FILE) and os.path.getsize(METRICS_FILE) + len(text) > METRICS_FILE_MAX_BYTES:
+        os.replace(METRICS_FILE, METRICS_FILE + ".1")
+    with open(METRICS_FILE, "a") as f:
+        f.write(text)
+
+
+# Write the spans recorded so far to METRICS_FILE
+def flush_metrics():
+    with _flush_lock:
+        with _lock:
+            lines = _pending[:]
+            _pending.clear()
+        if not lines:
+            return
+        try:
+            _write_lines(lines)
+        except OSError as error:
+            print(f"Error writing metrics: {error}")
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush_metrics()
+
+
+# Started with the first span, the spans still pending are written at exit
+def _start_writer():
+    global _writer
+    if _writer is None:
+        _writer = threading.Thread(target=_flush_forever, daemon=True, name="metrics_writer")
+        _writer.start()
+        atexit.register(flush_metrics)
+
+
+# Record how long a stage took, with the thread and run it belongs to
+def record_span(stage, duration, thread_id=None, run_id=None, **labels):
+    record = {
+        "time": time.time(),
+        "stage": stage,
+        "duration": duration,
+        "thread_id": thread_id,
+        "run_id": run_id,
+    }
+    record.update(labels)
+    line = json.dumps(record) + "\n"
+
+    with _lock:
+        if stage not in _durations:
+            _durations[stage] = deque(maxlen=METRICS_WINDOW)
+            _totals[stage] = [0, 0.0]
+        _durations[stage].append(duration)
+        _totals[stage][0] += 1
+        _totals[stage][1] += duration
+        _pending.append(line)
+        _start_writer()
+
+
+# Add to a counter, e.g. API round-trips made or saved
+def count(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+# Time the body of a with block as a stage.
+# The yielded dict holds the span labels, so ids known only later (e.g. the run id) can be added.
+@contextmanager
+def span(stage, **labels):
+    start = timeit.default_timer()
+    try:
+        yield labels
+    finally:
+        record_span(stage, timeit.default_timer() - start, **labels)
+
+
+# Record the time a run spent queued and in progress, from the run's own timestamps (whole seconds).
+# The in-progress span carries the run's token usage when the API reports it.
+def record_run_spans(run, thread_id):
+    if run is None or not run.created_at:
+        return
+    if run.started_at:
+        record_span("run_queued", run.started_at - run.created_at, thread_id, run.id)
+    finished_at = run.completed_at or run.failed_at or run.cancelled_at or run.expired_at
+    if run.started_at and finished_at:
+        usage = {}
+        if getattr(run, "usage", None):
+            usage = {"prompt_tokens": run.usage.prompt_tokens, "completion_tokens": run.usage.completion_tokens}
+        record_span("run_in_progress", finished_at - run.started_at, thread_id, run.id, status=run.status, **usage)
+
+
+def _quantile(values, q):
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+# {stage: {"count", "sum", "p50", "p95", "p99"}} over the recent window of each stage
+def summaries():
+    with _lock:
+        snapshot = {stage: (sorted(values), list(_totals[stage])) for stage, values in _durations.items()}
+
+    result = {}
+    for stage, (values, (count, total)) in snapshot.items():
+        summary = {"count": count, "sum": total}
+        for q in QUANTILES:
+            summary[f"p{int(q * 100)}"] = _quantile(values, q) if values else None
+        result[stage] = summary
+    return result
+
+
+def prometheus_text():
+    lines = [
+        "# HELP chat_turn_stage_seconds Duration of each stage of a chat turn.",
+        "# TYPE chat_turn_stage_seconds summary",
+    ]
+    for stage, summary in sorted(summaries().items()):
+        for q in QUANTILES:
+            value = summary[f"p{int(q * 100)}"]
+            if value is not None:
+                lines.append(f'chat_turn_stage_seconds{{stage="{stage}",quantile="{q}"}} {value}')
+        lines.append(f'chat_turn_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]}')
+        lines.append(f'chat_turn_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+    for name, value in sorted(counters().items()):
+        lines.append(f"# TYPE chat_{name}_total counter")
+        lines.append(f"chat_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+# Serve /metrics on METRICS_HOST:METRICS_PORT from a background thread, once per process
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return _server or None
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as error:
+            # Do not try again on every call
+            print(f"Metrics endpoint not started on port {port}: {error}")
+            _server = False
+            return None
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        print(f"Metrics endpoint listening on {host}:{port}/metrics")
+        return _server
@@ -0,0 +1,134 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from openai import OpenAIError
+from turn_metrics import count, span
+
+
+# Empty threads created ahead of time for the first turn of new interviews. A turn that
+# takes one runs on it right away, its message going with the run, instead of creating
+# the thread in its own request (when the assistant's instructions are not known, see
+# chat_turn.run_turn) or together with the run (create_and_run).
+# A background thread keeps WARM_THREADS of them, deletes the ones older than
+# WARM_THREAD_TTL seconds and counts hits and misses (warm_thread_hits, warm_thread_misses).
+
+# Threads kept ready, 0 to disable the pool
+WARM_THREADS = int(os.getenv("WARM_THREADS", "0"))
+WARM_THREAD_TTL = float(os.getenv("WARM_THREAD_TTL", "1800"))
+# Seconds to wait before creating threads again after an API error
+WARM_THREAD_RETRY_SECONDS = float(os.getenv("WARM_THREAD_RETRY_SECONDS", "5"))
+
+
+class WarmThreadPool:
+    # get_client() returns the client to create and delete the threads with, so the pool
+    # follows the cached client when it is replaced (see resources.invalidate)
+    def __init__(self, get_client, size=WARM_THREADS, ttl=WARM_THREAD_TTL):
+        self.get_client = get_client
+        self.size = size
+        self.ttl = ttl
+        # (thread id, creation time), oldest first
+        self._threads = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    # The id of an unused thread, None when there is none ready
+    def take(self):
+        now = time.monotonic()
+        with self._lock:
+            # The newest one, expired ones are left to the background thread to delete
+            thread_id = None
+            if self._threads and now - self._threads[-1][1] < self.ttl:
+                thread_id = self._threads.pop()[0]
+            if thread_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count("warm_thread_hits" if thread_id else "warm_thread_misses")
+        self._wake.set()
+        return thread_id
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "ready": len(self._threads), "hits": self.hits, "misses": self.misses}
+
+    def _expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = []
+            while self._threads and now - self._threads[0][1] >= self.ttl:
+                expired.append(self._threads.popleft()[0])
+        return expired
+
+    def _delete(self, thread_ids):
+        for thread_id in thread_ids:
+            try:
+                self.get_client().beta.threads.delete(thread_id)
+            except OpenAIError as error:
+                print(f"Error deleting warm thread {thread_id}: {error}")
+        count("warm_threads_deleted", len(thread_ids))
+
+    def _fill(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if len(self._threads) >= self.size:
+                    return
+            with span("warm_thread_create") as labels:
+                thread = self.get_client().beta.threads.create()
+                labels["thread_id"] = thread.id
+            with self._lock:
+                self._threads.append((thread.id, time.monotonic()))
+            count("warm_threads_created")
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._delete(self._expired())
+                self._fill()
+            except OpenAIError as error:
+                print(f"Error creating warm threads: {error}")
+                self._stop.wait(WARM_THREAD_RETRY_SECONDS)
+                continue
+            # Until a thread is taken or the oldest one expires
+            with self._lock:
+                oldest = self._threads[0][1] if self._threads else None
+            timeout = self.ttl if oldest is None else max(0.0, oldest + self.ttl - time.monotonic())
+            self._wake.wait(timeout)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    # Stop refilling and delete the threads nobody took
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        with self._lock:
+            unused = [thread_id for thread_id, _ in self._threads]
+            self._threads.clear()
+        self._delete(unused)
+
+
+_warm_thread_pool = None
+_warm_thread_pool_lock = threading.Lock()
+
+
+# The process's pool, started on first use and emptied at exit. None when WARM_THREADS is 0.
+def get_warm_thread_pool(get_client):
+    global _warm_thread_pool
+    if WARM_THREADS <= 0:
+        return None
+    with _warm_thread_pool_lock:
+        if _warm_thread_pool is None:
+            _warm_thread_pool = WarmThreadPool(get_client).start()
+            atexit.register(_warm_thread_pool.stop)
+        return _warm_thread_pool
@@ -0,0 +1,164 @@
+import csv
+import heapq
+import json
+import math
+import os
+import timeit
+import psycopg2
+from psycopg2 import sql
+from db_pool import pooled_connection
+
+
+# Nearest-location index for Ciudad de México and Estado de México candidates.
+# At export time every postal code of those states is mapped to the k nearest
+# active locations with available positions, using a local table of postal code
+# centroids. The chat app then answers "stores near my zip code" with a dict lookup.
+
+# Postal code centroids: the GeoNames MX.txt dump (tab separated) or a CSV with
+# zip, lat and lon columns. Kept outside the working directory root so
+# load_to_vector_store does not upload it.
+POSTAL_CENTROIDS_PATH = os.getenv("POSTAL_CENTROIDS_PATH", os.path.join("postal_codes", "MX.txt"))
+ZIP_INDEX_FILE = os.getenv("ZIP_INDEX_FILE", "nearest_locations_by_zip.json")
+ZIP_INDEX_K = int(os.getenv("ZIP_INDEX_K", "5"))
+
+# Postal code ranges of Ciudad de México and Estado de México
+PROXIMITY_ZIP_RANGES = [(1000, 16999), (50000, 57999)]
+
+
+def normalize_zip(zip_code):
+    digits = "".join(ch for ch in str(zip_code) if ch.isdigit())
+    return digits.zfill(5) if digits else None
+
+
+def in_proximity_ranges(zip_code):
+    number = int(zip_code)
+    return any(low <= number <= high for low, high in PROXIMITY_ZIP_RANGES)
+
+
+# Distance in km between two (lat, lon) points
+def haversine(a, b):
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(h))
+
+
+# Read the centroid table into {zip: (lat, lon)}.
+# A postal code can have several places, their coordinates are averaged.
+def load_centroids(path=POSTAL_CENTROIDS_PATH):
+    points = {}
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.endswith(".csv"):
+            rows = ((row["zip"], row["lat"], row["lon"]) for row in csv.DictReader(file))
+        else:
+            # GeoNames: country, postal code, place, admin1, code1, admin2, code2, admin3, code3, lat, lon, accuracy
+            rows = ((row[1], row[9], row[10]) for row in csv.reader(file, delimiter="\t") if len(row) > 10)
+
+        for zip_code, lat, lon in rows:
+            zip_code = normalize_zip(zip_code)
+            if not zip_code or not lat or not lon:
+                continue
+            points.setdefault(zip_code, []).append((float(lat), float(lon)))
+
+    return {
+        zip_code: (sum(p[0] for p in coords) / len(coords), sum(p[1] for p in coords) / len(coords))
+        for zip_code, coords in points.items()
+    }
+
+
+# Precompute the k nearest locations of every CDMX/Edomex postal code and save them to a file.
+# The locations come from the given export snapshot, or from the database without one.
+def generate_nearest_locations_by_zip(
+    snapshot=None, k=ZIP_INDEX_K, centroids_path=POSTAL_CENTROIDS_PATH, filename=ZIP_INDEX_FILE
+):
+    if not os.path.exists(centroids_path):
+        print(f"Postal code centroids not found at '{centroids_path}', skipping '{filename}'.")
+        return
+
+    try:
+        start = timeit.default_timer()
+        centroids = load_centroids(centroids_path)
+
+        if snapshot is not None:
+            locations = [
+                (location.id, location.zip) for location in snapshot.locations.values() if location.position_ids
+            ]
+        else:
+            with pooled_connection() as connection:
+                with connection.cursor() as cursor:
+                    # Active locations with available positions
+                    cursor.execute(sql.SQL("""
+                        SELECT DISTINCT l.id, l.zip
+                        FROM locations l
+                        JOIN locations_positions lp ON l.id = lp.location_id
+                        JOIN positions p ON lp.position_id = p.id
+                        WHERE l.is_active = TRUE
+                          AND p.is_active = TRUE
+                          AND lp.filled_openings < lp.max_openings
+                    """))
+                    locations = cursor.fetchall()
+                connection.commit()
+
+        # Place each location at the centroid of its postal code
+        located = []
+        missing = 0
+        for location_id, zip_code in locations:
+            point = centroids.get(normalize_zip(zip_code))
+            if point is None:
+                missing += 1
+                continue
+            located.append((location_id, point))
+
+        index = {}
+        for zip_code, point in centroids.items():
+            if not in_proximity_ranges(zip_code):
+                continue
+            nearest = heapq.nsmallest(
+                k, ((haversine(point, location_point), location_id) for location_id, location_point in located)
+            )
+            index[zip_code] = [[location_id, round(distance, 2)] for distance, location_id in nearest]
+
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump({"k": k, "nearest": index}, file)
+
+        print(
+            f"File '{filename}' generated successfully: {len(index)} postal codes, "
+            f"{len(located)} locations ({missing} without a known postal code) "
+            f"in {timeit.default_timer() - start:.3f}s"
+        )
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error: {error}")
+
+
+class ZipIndex:
+    def __init__(self, data):
+        self.k = data["k"]
+        self.nearest_by_zip = data["nearest"]
+        self.zips_by_prefix = {}
+        for zip_code in self.nearest_by_zip:
+            self.zips_by_prefix.setdefault(zip_code[:3], []).append(zip_code)
+
+    # [(location_id, km), ...] for the k nearest locations to a postal code.
+    # Unknown postal codes fall back to the closest known one with the same 3-digit prefix.
+    def nearest(self, zip_code, k=None):
+        zip_code = normalize_zip(zip_code)
+        if zip_code is None:
+            return []
+        k = min(k or self.k, self.k)
+
+        nearest = self.nearest_by_zip.get(zip_code)
+        if nearest is None:
+            same_area = self.zips_by_prefix.get(zip_code[:3])
+            if not same_area:
+                return []
+            closest = min(same_area, key=lambda z: abs(int(z) - int(zip_code)))
+            nearest = self.nearest_by_zip[closest]
+        return [tuple(item) for item in nearest[:k]]
+
+
+def load_zip_index(filename=ZIP_INDEX_FILE):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, encoding="utf-8") as file:
+        return ZipIndex(json.load(file))